@@ -21,11 +21,13 @@ def read_medical_image(input_path: str) -> tuple[np.ndarray, np.ndarray]:
     elif os.path.isdir(input_path):
         dicom_files = sorted(glob(os.path.join(input_path, '*.dcm')),
                              key=lambda x: int(os.path.basename(x).split('_')[-1].split('.')[0]))
-        data_list = [dcmread(f).pixel_array for f in dicom_files]
+        # 首个文件只读一次：间距取自它的头信息，像素也直接复用，不再为像素重新读取
+        first = dcmread(dicom_files[0])
+        spacing = np.array([float(first.SliceThickness),
+                            float(first.PixelSpacing[1]),
+                            float(first.PixelSpacing[0])])
+        data_list = [first.pixel_array] + [dcmread(f).pixel_array for f in dicom_files[1:]]
         data = np.stack(data_list, axis=0)  # 格式：(z,y,x)
-        spacing = np.array([dcmread(dicom_files[0]).SliceThickness,
-                            dcmread(dicom_files[0]).PixelSpacing[1],
-                            dcmread(dicom_files[0]).PixelSpacing[0]])
 
     else:
         raise ValueError("仅支持NII文件或DICOM文件夹输入")
@@ -1,9 +1,12 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import numpy as np
-import pydicom
+import sys
 import nibabel as nib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.volume import read_dicom_series, write_nii
+from common.batch import parse_workers, DEFAULT_IO_THREADS
+from common.manifest import BatchManifest, MANIFEST_NAME, run_incremental
 
 def ensure_dir(path: str):#创建文件夹
     if not os.path.exists(path):
@@ -15,32 +18,15 @@ def load_original_nii_geometry(original_nii_path: str):
     affine = nii_img.affine
     return affine
 
-def load_dicom_series_pixels(dcm_folder: str):
-    files = [
-        os.path.join(dcm_folder, f)
-        for f in os.listdir(dcm_folder)
-        if f.lower().endswith(".dcm")
-    ]
-
-    if not files:
-        raise ValueError(f"没有在{dcm_folder}找到DICOM文件")
-
-    datasets = [pydicom.dcmread(f) for f in files]
-
-
-    datasets.sort(key=lambda d: int(getattr(d, "InstanceNumber", 0)))
-
-
-    slices = [ds.pixel_array.astype(np.int16) for ds in datasets]
-    volume = np.stack(slices, axis=-1)
-
-    return volume
+def load_dicom_series_pixels(dcm_folder: str, threads: int = DEFAULT_IO_THREADS):
+    return read_dicom_series(dcm_folder, threads).data
 
 
 def convert_dcm_to_nii_with_original_geometry(
     dcm_folder: str,
     original_nii_path: str,
-    output_root: str = None
+    output_root: str = None,
+    threads: int = DEFAULT_IO_THREADS
 ):
 
  #26_dcm → nii_dcm26.nii
@@ -59,25 +45,30 @@ def convert_dcm_to_nii_with_original_geometry(
     output_name = f"nii_dcm{series_id}.nii"
     output_path = os.path.join(output_root, output_name)
 
-    affine = load_original_nii_geometry(original_nii_path)
+    #只解码一次DICOM，几何信息取自原始NII
+    volume = read_dicom_series(dcm_folder, threads)
+    volume.affine = load_original_nii_geometry(original_nii_path)
 
-    volume = load_dicom_series_pixels(dcm_folder)
-
-    nii_img = nib.Nifti1Image(volume, affine)
-    nib.save(nii_img, output_path)
+    write_nii(volume, output_path)
 
     print(f"DCM成功转换为NII!\n"
           f"输入文件地址：{dcm_folder}\n"
           f"输出文件地址：{output_path}\n")
     print(f"原始图像信息: {original_nii_path}")
     print(f"图像尺寸大小: {volume.shape}")
+    return output_path
 
 
 def batch_convert_dcm_to_nii(
     dcm_root: str,
     original_nii_root: str,
-    output_root: str = None
+    output_root: str = None,
+    workers: int = 1,
+    incremental: bool = True,
+    content_hash: bool = False
 ):
+    #incremental=True时在输出目录记录清单（.batch_manifest.json），DCM序列和原始NII都没变的病例直接跳过；
+    #content_hash=True时修改时间变了还会比较文件内容
 
     folders = [
         os.path.join(dcm_root, f)
@@ -85,6 +76,7 @@ def batch_convert_dcm_to_nii(
         if f.endswith("_dcm") and os.path.isdir(os.path.join(dcm_root, f))
     ]
 
+    jobs = []
     for folder in folders:
         folder_name = os.path.basename(folder)
         series_id = folder_name.replace("_dcm", "")
@@ -96,14 +88,33 @@ def batch_convert_dcm_to_nii(
             print(f"[警告] 丢失原来NII文件{original_nii_path}")
             continue
 
-        convert_dcm_to_nii_with_original_geometry(
-            dcm_folder=folder,
-            original_nii_path=original_nii_path,
-            output_root=output_root
-        )
+        jobs.append((folder, original_nii_path, output_root))
+
+    manifest = None
+    if incremental:
+        manifest = BatchManifest(os.path.join(output_root if output_root else ".", MANIFEST_NAME), content_hash)
+
+    #workers>1时多进程并行，大序列优先
+    results = run_incremental(
+        convert_dcm_to_nii_with_original_geometry,
+        jobs,
+        inputs=[job[:2] for job in jobs],
+        manifest=manifest,
+        params={"tool": "dcm-nii", "output_root": os.path.abspath(output_root if output_root else ".")},
+        workers=workers,
+        size_paths=[job[0] for job in jobs]
+    )
+    for r in results:
+        if not r.ok:
+            print(f"[失败] {jobs[r.index][0]}：{r.error}")
+    skipped = sum(r.skipped for r in results)
+    if skipped:
+        print(f"{skipped}个序列未变化，已跳过")
 
     print("转换成功!")
+    return results
 if __name__ == "__main__":
+    WORKERS = parse_workers()  #并行进程数，命令行 --workers N
     #下面需要根据自己的路径去修改！
     #当前是单一的DCM文件转NII文件
     convert_dcm_to_nii_with_original_geometry(
@@ -114,6 +125,7 @@ if __name__ == "__main__":
     #下面是多个DCM文件转NII文件
     #batch_convert_dcm_to_nii(
     #dcm_root="G:/mry1/TOM500/data preprocess/dicom",
-    #output_root="G:/mry1/TOM500/data preprocess/niioutput"
+    #output_root="G:/mry1/TOM500/data preprocess/niioutput",
+    #workers=WORKERS
     #)
     pass
@@ -1,57 +1,44 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import numpy as np
-import pydicom
-
-
-def ensure_dir(path: str):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-def dcm_folder_to_npz(dcm_folder: str, output_root: str = None):
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import DEFAULT_IO_THREADS
+from common.volume import ensure_dir, read_dicom_series, write_npz, write_npy, write_chunked_volume
+
+
+def dcm_folder_to_npz(
+        dcm_folder: str,
+        output_root: str = None,
+        threads: int = DEFAULT_IO_THREADS,
+        output_format: str = "npz",
+        codec: str = "zlib"
+):
     output_root = output_root if output_root else "."
     ensure_dir(output_root)
 
     folder_name = os.path.basename(dcm_folder.rstrip("/"))
-    output_path = os.path.join(output_root, f"{folder_name}.npz")
-
-    files = [
-        os.path.join(dcm_folder, f)
-        for f in os.listdir(dcm_folder)
-        if f.lower().endswith(".dcm")
-    ]
-
-    if not files:
-        raise ValueError("No DICOM files found")
-
-    datasets = [pydicom.dcmread(f) for f in files]
-    datasets.sort(key=lambda d: int(getattr(d, "InstanceNumber", 0)))
-
-    volume = np.stack([ds.pixel_array for ds in datasets], axis=-1).astype(np.int16)
-
-    ds0 = datasets[0]
-    spacing = [
-        float(ds0.PixelSpacing[0]),
-        float(ds0.PixelSpacing[1]),
-        float(getattr(ds0, "SliceThickness", 1.0))
-    ]
-
-    affine = np.diag([spacing[1], spacing[0], spacing[2], 1.0])
-
-    np.savez_compressed(
-        output_path,
-        image=volume,
-        affine=affine,
-        spacing=np.array(spacing),
-        source_type="dcm",
-        source_name=folder_name
-    )
 
-    print(f"成功转换为NPZ文件！\n"
+    # image/affine/spacing/source_type/source_name 均由Volume携带
+    # threads为并发读取DICOM文件的线程数（1为串行）
+    volume = read_dicom_series(dcm_folder, threads)
+    # output_format="npy"时输出可内存映射的文件夹（xxx_npy/image.npy + meta.json）
+    if output_format == "npy":
+        output_path = write_npy(volume, os.path.join(output_root, f"{folder_name}_npy"))
+    # output_format="vchk"时输出分块压缩文件，每8张切片独立压缩，取单张切片只解压所在的块
+    elif output_format == "vchk":
+        output_path = write_chunked_volume(volume, os.path.join(output_root, f"{folder_name}.vchk"), codec=codec)
+    else:
+        output_path = write_npz(volume, os.path.join(output_root, f"{folder_name}.npz"))
+
+    fmt = output_format.upper()
+    print(f"成功转换为{fmt}文件！\n"
           f"原始DCM文件路径：{dcm_folder} \n"
-          f"输出NPZ文件路径：{output_path}")
+          f"输出{fmt}文件路径：{output_path}")
 
 #下面为主函数，根据实际路径修改！
-dcm_folder_to_npz("G:/mry1/TOM500/data preprocess/dicom/26_dcm",
-   output_root="G:/mry1/TOM500/data preprocess/npzoutput")
+if __name__ == "__main__":
+    OUTPUT_FORMAT = "npz"  # 下游（U-SAM数据集等）读取.npz；需要按块读取切片时可改为"vchk"，内存映射为"npy"
+    dcm_folder_to_npz("G:/mry1/TOM500/data preprocess/dicom/26_dcm",
+       output_root="G:/mry1/TOM500/data preprocess/npzoutput",
+       output_format=OUTPUT_FORMAT)
@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 import pydicom
 import os
+import sys
 import cv2
 import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import imap_ordered, DEFAULT_IO_THREADS
+from common.png_export import export_slices_png, DEFAULT_ENCODE_THREADS
 
 # 根据自己的输入输出路径进行修改！
 input_folder = ("G:/mry1/TOM500/data preprocess/dicom/39_dcm")  # 输入DICOM文件夹路径
@@ -11,6 +15,8 @@ output_root = "G:/mry1/TOM500/data preprocess/png"  # PNG输出，填到根路
 file_ext = "png"  # 输出格式（png/jpg）
 digit_length = 3  # 编号位数（如3表示001, 002...）
 source_format = "dcm"  # 转换前格式
+io_threads = DEFAULT_IO_THREADS  # 并发读取DICOM文件的线程数（1为串行）
+encode_threads = DEFAULT_ENCODE_THREADS  # 并行编码PNG的线程数（1为串行）
 # 自动生成输出文件夹名
 input_folder_name = os.path.basename(input_folder)
 if input_folder_name.lower().endswith("_dcm"):
@@ -34,96 +40,57 @@ print(f"输出路径：{output_folder}")
 print(f"文件名格式：{file_ext}_{source_format}001.{file_ext}、{file_ext}_{source_format}002.{file_ext}...")
 
 total_slices = 0  # 统计总切片数
-converted_slices = 0  # 统计成功转换的切片数
 
-for dcm_idx, dcm_filename in enumerate(dcm_files, 1):
-    dcm_path = os.path.join(input_folder, dcm_filename)
 
+def read_frames(dcm_filename):
+    """
+    在线程池中读取并解码一个DICOM文件，统一整理为(切片数, 高度, 宽度)：
+    2D数据(h, w)视为1张切片，3D数据(z, h, w)逐张切片，彩色(RGB)先转灰度
+    """
     try:
         # 读取DICOM文件（保留元数据，确保空间信息不丢失）
-        ds = pydicom.dcmread(dcm_path, force=True)
+        ds = pydicom.dcmread(os.path.join(input_folder, dcm_filename), force=True)
         pixel_array = ds.pixel_array
-        # 3D数据（z, h, w）
-        if len(pixel_array.shape) == 3:
-            z_slices, height, width = pixel_array.shape
-            print(f"\n处理DICOM文件：{dcm_filename}")
-            print(f"数据维度：{pixel_array.shape} (切片数×高度×宽度)")
-
-            # 遍历每个切片
-            for slice_idx in range(z_slices):
-                # 获取当前切片数据
-                slice_data = pixel_array[slice_idx, :, :]
-
-                # 数据归一化（保持原始数据分布，避免信息丢失）
-                if slice_data.dtype in [np.uint16, np.int16, np.float32, np.float64]:
-                    # 使用min-max归一化到0-255
-                    slice_min = np.min(slice_data)
-                    slice_max = np.max(slice_data)
-                    if slice_max > slice_min:  # 避免除零错误
-                        slice_data = ((slice_data - slice_min) / (slice_max - slice_min) * 255).astype(np.uint8)
-                    else:
-                        slice_data = np.zeros_like(slice_data, dtype=np.uint8)
-
-                # 处理RGB转灰度（如果是彩色DICOM）
-                if len(slice_data.shape) == 3 and slice_data.shape[2] == 3:
-                    slice_data = cv2.cvtColor(slice_data, cv2.COLOR_RGB2GRAY)
-
-                # 生成统一格式的文件名（png001, png002...）
-                total_slices += 1
-                png_filename = f"{file_ext}_{source_format}{total_slices:0{digit_length}d}.{file_ext}"
-                png_path = os.path.join(output_folder, png_filename)
-
-                success = cv2.imwrite(png_path, slice_data, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-                # 保存PNG文件（使用cv2.IMWRITE_PNG_COMPRESSION控制压缩质量）
-                if success:
-                    converted_slices += 1
-                    print(f"  切片 {slice_idx + 1}/{z_slices} → {png_filename} (成功)")
-                else:
-                    print(f"  切片 {slice_idx + 1}/{z_slices} → {png_filename} (保存失败)")
-
-        # 2D数据（h, w）
-        elif len(pixel_array.shape) == 2:
-            height, width = pixel_array.shape
-            print(f"\n处理DICOM文件：{dcm_filename}")
-            print(f"数据维度：{pixel_array.shape}")
-
-            # 数据归一化
-            if pixel_array.dtype in [np.uint16, np.int16, np.float32, np.float64]:
-                slice_min = np.min(pixel_array)
-                slice_max = np.max(pixel_array)
-                if slice_max > slice_min:
-                    pixel_array = ((pixel_array - slice_min) / (slice_max - slice_min) * 255).astype(np.uint8)
-                else:
-                    pixel_array = np.zeros_like(pixel_array, dtype=np.uint8)
-
-            # RGB转灰度
-            if len(pixel_array.shape) == 3 and pixel_array.shape[2] == 3:
-                pixel_array = cv2.cvtColor(pixel_array, cv2.COLOR_RGB2GRAY)
-
-            # 生成文件名
+        is_rgb = int(getattr(ds, "SamplesPerPixel", 1)) == 3
+        if is_rgb and pixel_array.ndim in (3, 4):
+            pixel_array = pixel_array.reshape((-1,) + pixel_array.shape[-3:])
+            pixel_array = np.stack([cv2.cvtColor(f, cv2.COLOR_RGB2GRAY) for f in pixel_array])
+        elif pixel_array.ndim == 2:
+            pixel_array = pixel_array[np.newaxis]
+        elif pixel_array.ndim != 3:
+            return None, f"不支持的数据维度：{pixel_array.shape}"
+        return pixel_array, None
+    except Exception as e:
+        return None, str(e)
+
+
+def iter_output_slices():
+    # 文件在后台线程中预读，这里按原顺序统一编号（png_dcm001、png_dcm002...）
+    global total_slices
+    frames_iter = imap_ordered(read_frames, dcm_files, io_threads)
+    for dcm_filename, (frames, error) in zip(dcm_files, frames_iter):
+        if error is not None:
+            print(f"\n处理DICOM文件 {dcm_filename} 时出错：{error}")
+            continue
+        for slice_data in frames:
             total_slices += 1
             png_filename = f"{file_ext}_{source_format}{total_slices:0{digit_length}d}.{file_ext}"
-            png_path = os.path.join(output_folder, png_filename)
-
-            # 保存文件
-            success = cv2.imwrite(png_path, pixel_array, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+            yield os.path.join(output_folder, png_filename), slice_data
 
-            if success:
-                converted_slices += 1
-                print(f"  → {png_filename} (成功)")
-            else:
-                print(f"  → {png_filename} (保存失败)")
 
-
-        else:
-            print(f"\n跳过DICOM文件：{dcm_filename}")
-            print(f"不支持的数据维度：{pixel_array.shape}")
-
-    except Exception as e:
-        print(f"\n处理DICOM文件 {dcm_filename} 时出错：{str(e)}")
-        continue
+# uint16/int16/浮点切片逐张min-max归一化到0-255（常数切片输出全0），其他类型（uint8等）原样保存；
+# 编码在线程池中并行，进度用一个进度条汇总显示
+converted_slices = export_slices_png(
+    iter_output_slices(),
+    flat_to_zero=True,
+    normalize_dtypes=(np.uint16, np.int16, np.float32, np.float64),
+    threads=encode_threads,
+    params=[cv2.IMWRITE_PNG_COMPRESSION, 0],
+    desc="DCM→PNG"
+)
 
 # 输出转换总结
 print(f"DCM成功转换为PNG！")
 print(f"处理的DICOM文件数：{len(dcm_files)}")
+print(f"切片总数：{total_slices}")
 print(f"成功转换的切片数：{converted_slices}")
@@ -1,43 +1,39 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import numpy as np
-import nibabel as nib
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.volume import ensure_dir, read_nii, write_npz, write_npy, write_chunked_volume
+from common.slice_index import compute_slice_index, write_slice_index
 
 
-def ensure_dir(path: str):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-def nii_to_npz(nii_path: str, output_root: str = None):
+def nii_to_npz(nii_path: str, output_root: str = None, output_format: str = "npz", codec: str = "zlib",
+               slice_index: bool = None):
     output_root = output_root if output_root else "."
     ensure_dir(output_root)
 
     name = os.path.splitext(os.path.basename(nii_path))[0]
-    output_path = os.path.join(output_root, f"{name}.npz")
-
-    img = nib.load(nii_path)
-    data = img.get_fdata().astype(np.float32)
-    affine = img.affine
-
-    # voxel spacing
-    spacing = (
-        np.linalg.norm(affine[:3, 0]),
-        np.linalg.norm(affine[:3, 1]),
-        np.linalg.norm(affine[:3, 2])
-    )
 
-    np.savez_compressed(
-        output_path,
-        image=data,
-        affine=affine,
-        spacing=np.array(spacing),
-        source_type="nii",
-        source_name=os.path.basename(nii_path)
-    )
-    print(f"成功转换为NPZ文件！\n"
+    # 保留NII中存储的原始类型（掩膜为uint8），scl_slope/scl_inter随文件一起写出
+    volume = read_nii(nii_path)
+    # output_format="npy"时输出可内存映射的文件夹（xxx_npy/image.npy + meta.json）
+    if output_format == "npy":
+        output_path = write_npy(volume, os.path.join(output_root, f"{name}_npy"))
+    # output_format="vchk"时输出分块压缩文件，每8张切片独立压缩，取单张切片只解压所在的块
+    elif output_format == "vchk":
+        output_path = write_chunked_volume(volume, os.path.join(output_root, f"{name}.vchk"), codec=codec)
+    else:
+        output_path = write_npz(volume, os.path.join(output_root, f"{name}.npz"))
+    # 标签数据（掩码）顺带写出前景切片索引（如1.vchk.slice_index.json），None时自动判断
+    if slice_index is not False:
+        write_slice_index(compute_slice_index(volume.data, 2, force=slice_index is True), output_path)
+    fmt = output_format.upper()
+    print(f"成功转换为{fmt}文件！\n"
           f"原始NII文件路径：{nii_path} \n"
-          f"输出NPZ文件路径：{output_path}")
+          f"输出{fmt}文件路径：{output_path}")
 
-nii_to_npz("G:/mry1/TOM500/data preprocess/mask1/1.nii",
-    output_root="G:/mry1/TOM500/data preprocess/npzoutput")
\ No newline at end of file
+if __name__ == "__main__":
+    OUTPUT_FORMAT = "npz"  # 下游（U-SAM数据集等）读取.npz；需要按块读取切片时可改为"vchk"，内存映射为"npy"
+    nii_to_npz("G:/mry1/TOM500/data preprocess/mask1/1.nii",
+        output_root="G:/mry1/TOM500/data preprocess/npzoutput",
+        output_format=OUTPUT_FORMAT)
\ No newline at end of file
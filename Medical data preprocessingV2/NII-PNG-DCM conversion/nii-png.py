@@ -1,13 +1,16 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
-import nibabel as nib
-import numpy as np
-import cv2
 import os
+import sys
 from glob import glob
-from tqdm import tqdm
+import nibabel as nib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.volume import read_nii, write_png_stack, write_png_stack_from_nii
+from common.batch import parse_workers
+from common.manifest import BatchManifest, MANIFEST_NAME, run_incremental
+from common.slice_index import SliceIndexBuilder, compute_slice_index, write_slice_index
 
-def nii_to_png_single(nii_file_path, out_root_dir, slice_axis=2):
+def nii_to_png_single(nii_file_path, out_root_dir, slice_axis=2, stream=True, slice_index=None):
     if not os.path.exists(nii_file_path):
         raise FileNotFoundError(f"NII文件不存在：{nii_file_path}")
     if not (nii_file_path.endswith('.nii') or nii_file_path.endswith('.nii.gz')):
@@ -23,53 +26,69 @@ def nii_to_png_single(nii_file_path, out_root_dir, slice_axis=2):
     os.makedirs(out_dir, exist_ok=True)
 
 
-    nii_img = nib.load(nii_file_path)
-    nii_data = nii_img.get_fdata()
-    slice_num = nii_data.shape[slice_axis]  # 切片数量
-
-
-    for i in tqdm(range(slice_num), desc=f"转换 {nii_filename}"):
-        if slice_axis == 0:
-            slice_data = nii_data[i, :, :]
-        elif slice_axis == 1:
-            slice_data = nii_data[:, i, :]
-        else:
-            slice_data = nii_data[:, :, i]
-
-        # 归一化到0-255（适配PNG显示）
-        data_min = np.min(slice_data)
-        data_max = np.max(slice_data)
-        if data_max > data_min:
-            slice_data = (slice_data - data_min) / (data_max - data_min) * 255
-        slice_data = slice_data.astype(np.uint8)
-
-        # 按要求命名PNG：png{base_name}_{index:03d}.png（如"png1_000.png"）
-        png_filename = f"png_nii{i + 1:03d}.png"
-        png_save_path = os.path.join(out_dir, png_filename)
-        cv2.imwrite(png_save_path, slice_data)
+    # 逐切片归一化到0-255（适配PNG显示），命名为png_nii001.png...
+    # stream=True时从dataobj逐张读取，内存只占一张切片；False则先整体读入（get_fdata）
+    # 标签数据（掩码）顺带写出前景切片索引out_dir/slice_index.json，层号k对应png_nii{k+1:03d}.png；
+    # slice_index=None时自动判断，True强制生成，False不生成。流式导出时用导出已读出的切片累计，不再整卷读取
+    desc = f"转换 {nii_filename}"
+    force = slice_index is True
+    index = None
+    if stream:
+        builder = None
+        if slice_index is not False:
+            builder = SliceIndexBuilder(nib.load(nii_file_path).shape[slice_axis], slice_axis, force)
+        slice_num = write_png_stack_from_nii(nii_file_path, out_dir, slice_axis, prefix="png_nii", desc=desc,
+                                             on_slice=builder.add if builder else None)
+        if builder is not None:
+            index = builder.result()
+    else:
+        volume = read_nii(nii_file_path)
+        slice_num = write_png_stack(volume, out_dir, slice_axis, prefix="png_nii", desc=desc)
+        if slice_index is not False:
+            index = compute_slice_index(volume.data, slice_axis, force)
+
+    if slice_index is not False:
+        if write_slice_index(index, out_dir):
+            print(f"前景切片索引：{len(index['slices'])}/{slice_num}张含标签{index['labels']}")
 
     print(f"输入NII：{nii_file_path}")
     print(f"输出PNG文件夹：{out_dir}")
     print(f"PNG文件：png_nii001.png ~ png_nii{slice_num:03d}.png（共{slice_num}张）")
+    return out_dir
 
 
-def nii_to_png_batch(nifti_dir, out_root_dir, slice_axis=2):
+def nii_to_png_batch(nifti_dir, out_root_dir, slice_axis=2, workers=1, stream=True,
+                     incremental=True, content_hash=False):
     # 筛选有效NII文件
     nifti_files = sorted(glob(os.path.join(nifti_dir, "*.nii")) + glob(os.path.join(nifti_dir, "*.nii.gz")))
     if len(nifti_files) == 0:
         raise ValueError(f"NII文件夹中无有效文件：{nifti_dir}")
 
-    # 批量处理每个NII文件
-    for idx, nii_file in enumerate(nifti_files):
-        print(f"\n处理第 {idx + 1}/{len(nifti_files)} 个文件")
-        try:
-            nii_to_png_single(nii_file, out_root_dir, slice_axis)
-        except Exception as e:
-            print(f" 处理失败 {os.path.basename(nii_file)}：{str(e)}")
+    # incremental=True时在输出根目录记录清单，NII文件和切片方向都没变的病例直接跳过
+    manifest = BatchManifest(os.path.join(out_root_dir, MANIFEST_NAME), content_hash) if incremental else None
+
+    # 批量处理每个NII文件（workers>1时多进程并行，大文件优先）
+    print(f"\n共 {len(nifti_files)} 个文件，并行进程数：{max(workers, 1)}")
+    results = run_incremental(
+        nii_to_png_single,
+        [(nii_file, out_root_dir, slice_axis, stream) for nii_file in nifti_files],
+        inputs=[[nii_file] for nii_file in nifti_files],
+        manifest=manifest,
+        params={"tool": "nii-png", "out_root_dir": os.path.abspath(out_root_dir), "slice_axis": slice_axis},
+        workers=workers,
+        size_paths=nifti_files
+    )
+    for r in results:
+        if not r.ok:
+            print(f" 处理失败 {os.path.basename(nifti_files[r.index])}：{r.error}")
+    skipped = sum(r.skipped for r in results)
+    if skipped:
+        print(f" {skipped}个文件未变化，已跳过")
 
     # 输出批量处理结果
     print(f"输入NII文件夹：{nifti_dir}")
     print(f"输出PNG根目录：{out_root_dir}")
+    return results
 
 
 #下面的路径需要自己去调整！！！
@@ -77,6 +96,7 @@ if __name__ == "__main__":
     convert_mode=("single")#single单个NII，batch一系列NII
     OUT_ROOT_DIR="G:/mry1/TOM500/data preprocess/png"#输出路径
     SLICE_AXIS=2
+    WORKERS=parse_workers()#batch模式的并行进程数，命令行 --workers N
 
     if convert_mode=="single":
        input_nii = "G:/mry1/TOM500/data preprocess/mask2/39.nii"  # 输入.nii文件路径
@@ -84,4 +104,4 @@ if __name__ == "__main__":
 
     elif convert_mode=="batch":
         input_nii_dir="G:/mry1/TOM500/data preprocess/mask2"#输入.nii路径
-        nii_to_png_batch(input_nii_dir,OUT_ROOT_DIR,SLICE_AXIS)
\ No newline at end of file
+        nii_to_png_batch(input_nii_dir,OUT_ROOT_DIR,SLICE_AXIS,WORKERS)
\ No newline at end of file
@@ -1,11 +1,15 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pydicom
-from pydicom.dataset import Dataset, FileDataset
-from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
 import cv2
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import imap_ordered, DEFAULT_IO_THREADS
+from common.dicom_writer import DicomSeriesWriter, default_encode_workers
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless
 
 #下面的路径需要自己去调整！！！
 INPUT_FOLDER = "G:/mry1/TOM500/data preprocess/png/39_png"  # 输入文件夹路径(PNG/JPG)
@@ -19,73 +23,117 @@ SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg')  # 支持的输入格式
 TARGET_FORMAT = "dcm" # 转换后格式（用于文件名拼接）
 SOURCE_FORMAT = "png" # 转换前格式（用于文件名拼接）
 PATIENT_NAME = "Unknown"
-def create_dcm_dataset(
-        pixel_array: np.ndarray,
-        series_instance_uid: str,
-        instance_number: int,
+MULTIFRAME = False  # True时整个文件夹只写一个多帧DCM（如dcm_png.dcm），含每帧位置和方向
+RLE = False  # True时使用RLE Lossless无损压缩传输语法
+def create_series_writer(
+        is_color: bool,
+        bits_allocated: int,
+        series_uids: dict,
         pixel_spacing: list[float] = [0.312,0.312],
-        modality: str = "CT"
-) -> FileDataset:
-    # 生成唯一标识符（UID）
-    sop_instance_uid = pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
-    study_instance_uid = pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
-    frame_of_reference_uid = pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
-
-    # 创建DCM数据集
-    ds = Dataset()
-    ds.file_meta = Dataset()
-    ds.file_meta.MediaStorageSOPClassUID = pydicom.uid.CTImageStorage  # 根据模态调整
-    ds.file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
-    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian  # 传输语法（兼容大多数软件）
-    ds.file_meta.ImplementationClassUID = pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
-
-    # 核心元数据（确保医学影像软件可识别）
-    ds.StudyInstanceUID = study_instance_uid
-    ds.SeriesInstanceUID = series_instance_uid
-    ds.FrameOfReferenceUID = frame_of_reference_uid
-    ds.InstanceNumber = instance_number  # 切片序号（关键：与文件名编号一致）
-    ds.Modality = modality
-    ds.StudyDescription = STUDY_DESCRIPTION
-    ds.SeriesDescription = f"{modality}_Series"
-    ds.BodyPartExamined = "Unknown"
-
-    # 图像相关参数（保持空间信息准确）
-    ds.Rows, ds.Columns = pixel_array.shape[:2]  # 图像尺寸（高度×宽度）
-    ds.PixelSpacing = pixel_spacing  # 像素间距（mm/像素，医学影像核心空间参数）
-    ds.SliceThickness = pixel_spacing[0]  # 切片厚度（默认与像素间距一致，可自定义）
-    ds.SpacingBetweenSlices = pixel_spacing[0]
-
-    # 像素数据参数
-    if len(pixel_array.shape) == 3:  # 彩色图像（RGB）
-        ds.SamplesPerPixel = 3
-        ds.PhotometricInterpretation = "RGB"
-        ds.PlanarConfiguration = 0
-        ds.BitsAllocated = 8
-        ds.BitsStored = 8
-        ds.HighBit = 7
-    else:  # 灰度图像
-        ds.SamplesPerPixel = 1
-        ds.PhotometricInterpretation = "MONOCHROME2"
-        ds.BitsAllocated = 16
-        ds.BitsStored = 16
-        ds.HighBit = 15
-        pixel_array = (pixel_array.astype(np.uint16) << 8) | pixel_array.astype(np.uint16)
-
-    ds.PixelRepresentation = 0
-    ds.RescaleIntercept = 0.0  # 灰度转换截距
-    ds.RescaleSlope = 1.0  # 灰度转换斜率
-
-    # 设置像素数据
-    ds.PixelData = pixel_array.tobytes()
-
-    # 创建FileDataset（完整DCM文件对象）
-    file_ds = FileDataset(
-        "", ds, file_meta=ds.file_meta, preamble=b"\x00" * 128
+        modality: str = "CT",
+        transfer_syntax: str = ExplicitVRLittleEndian
+) -> DicomSeriesWriter:
+    # 同一文件夹的所有切片共用一份头信息模板和同一组Study/Series/FrameOfReference UID，
+    # 每张切片只补InstanceNumber、SOPInstanceUID和像素数据
+    return DicomSeriesWriter(
+        modality=modality,
+        sop_class_uid=pydicom.uid.CTImageStorage,  # 根据模态调整
+        pixel_spacing=pixel_spacing,  # 像素间距（mm/像素，医学影像核心空间参数）
+        slice_thickness=pixel_spacing[0],  # 切片厚度（默认与像素间距一致，可自定义）
+        bits_allocated=bits_allocated,
+        pixel_representation=0,
+        samples_per_pixel=3 if is_color else 1,
+        uid_prefix=DCM_UID_PREFIX,
+        transfer_syntax=transfer_syntax,
+        SpacingBetweenSlices=pixel_spacing[0],
+        StudyDescription=STUDY_DESCRIPTION,
+        SeriesDescription=f"{modality}_Series",
+        BodyPartExamined="Unknown",
+        RescaleIntercept=0.0,  # 灰度转换截距
+        RescaleSlope=1.0,  # 灰度转换斜率
+        **series_uids
     )
-    file_ds.is_little_endian = True
-    file_ds.is_implicit_VR = False
 
-    return file_ds
+
+def read_image_for_dcm(image_path: str):
+    # 读取图像（cv2默认BGR，转换为RGB以符合DCM标准）
+    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+
+    if len(img.shape) == 3 and img.shape[2] == 4:
+        img = img[:, :, :3]  # 移除Alpha通道，保留RGB
+    # 处理通道顺序（BGR→RGB）
+    if len(img.shape) == 3 and img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
+
+
+def writer_key(img: np.ndarray) -> tuple:
+    # (是否彩色, 位数)：8位图像按8位存储，16位PNG按16位存储，不再把8位数据复制到高字节
+    return img.ndim == 3, 16 if img.dtype == np.uint16 else 8
+
+
+# 当前进程的writer（灰度/彩色 × 8/16位）：主进程中由png_jpg_to_dcm创建，
+# RLE进程池中由initializer在每个子进程创建一次，任务里不再携带writer
+_writers = {}
+
+
+def init_writers(series_uids: dict, pixel_spacing: list, modality: str, transfer_syntax: str) -> dict:
+    global _writers
+    _writers = {
+        (is_color, bits): create_series_writer(
+            is_color, bits, series_uids, pixel_spacing, modality, transfer_syntax)
+        for is_color in (False, True) for bits in (8, 16)
+    }
+    return _writers
+
+
+def convert_image_to_dcm(job) -> tuple:
+    # 读取单张图像并写出DCM，返回(提示信息, 是否成功)；为模块级函数，RLE时可在进程池中执行
+    image_path, dcm_path, idx = job
+    image_filename, dcm_filename = os.path.basename(image_path), os.path.basename(dcm_path)
+    try:
+        img = read_image_for_dcm(image_path)
+        if img is None:
+            return f"跳过：无法读取图像 → {image_filename}", False
+        _writers[writer_key(img)].write(dcm_path, img, idx)
+        return f"成功：{image_filename} → {dcm_filename}", True
+    except Exception as e:
+        return f"失败：{image_filename} → 错误原因：{str(e)}", False
+
+
+def png_stack_to_multiframe_dcm(
+        input_folder: str,
+        image_files: list,
+        output_folder: str,
+        writers: dict,
+        dcm_filename: str,
+        threads: int = DEFAULT_IO_THREADS
+) -> None:
+    # 所有图像并行读取后按顺序堆叠为(帧数, 行, 列[, 3])，写成一个多帧DCM
+    frames = []
+    for image_filename, img in zip(image_files, imap_ordered(
+            lambda f: read_image_for_dcm(os.path.join(input_folder, f)), image_files, threads)):
+        if img is None:
+            print(f"跳过：无法读取图像 → {image_filename}")
+            continue
+        if frames and img.shape != frames[0].shape:
+            print(f"跳过：尺寸或通道数与第一张不一致 → {image_filename}")
+            continue
+        frames.append(img)
+    if not frames:
+        print("没有可转换的图像")
+        return
+
+    # 横断位，各帧沿z轴按切片间距依次排列
+    positions = [(0.0, 0.0, k * PIXEL_SPACING[0]) for k in range(len(frames))]
+    writer = writers[writer_key(frames[0])]
+    dcm_path = os.path.join(output_folder, dcm_filename)
+    writer.write_multiframe(dcm_path, np.stack(frames), positions, (1, 0, 0, 0, 1, 0))
+    print(f"PNG/JPG成功转换为多帧DCM！")
+    print(f"总图像数：{len(image_files)}")
+    print(f"成功转换帧数：{len(frames)} → {dcm_path}")
 
 
 def png_jpg_to_dcm(
@@ -93,7 +141,11 @@ def png_jpg_to_dcm(
         output_root: str,
         target_format: str = "dcm",
         source_format: str = "png",
-        digit_length: int = 3
+        digit_length: int = 3,
+        threads: int = DEFAULT_IO_THREADS,  # 并行读取/写出的线程数（1为串行）
+        multiframe: bool = False,
+        rle: bool = False,
+        encode_workers: int = None  # RLE编码进程数，None时为CPU核数（在批处理子进程中为1）
 ) -> None:
     #验证输入文件夹
     if not os.path.exists(input_folder):
@@ -127,48 +179,44 @@ def png_jpg_to_dcm(
         f"文件名格式：{target_format}_{source_format}001."
         f"{target_format}、{target_format}_{source_format}002.{target_format}...")
 
-    # 生成统一的Series Instance UID（同文件夹下的图像属于同一序列）
-    series_instance_uid = pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
-    converted_count = 0
+    # 生成统一的Study/Series/FrameOfReference UID（同文件夹下的图像属于同一序列）
+    series_uids = {
+        "study_uid": pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX),
+        "series_uid": pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX),
+        "frame_of_reference_uid": pydicom.uid.generate_uid(prefix=DCM_UID_PREFIX)
+    }
+    transfer_syntax = RLELossless if rle else ExplicitVRLittleEndian
+    writer_args = (series_uids, PIXEL_SPACING, MODALITY, transfer_syntax)
+    writers = init_writers(*writer_args)
+
+    if multiframe:
+        png_stack_to_multiframe_dcm(
+            input_folder, image_files, output_folder, writers,
+            f"{target_format}_{source_format}.{target_format}", threads)
+        return
 
-    # 批量转换图像
-    for idx, image_filename in enumerate(image_files, 1):
-        image_path = os.path.join(input_folder, image_filename)
-        try:
-            # 读取图像（cv2默认BGR，转换为RGB以符合DCM标准）
-            img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
-            if img is None:
-                print(f"跳过：无法读取图像 → {image_filename}")
-                continue
-
-            # 处理通道顺序（BGR→RGB）
-            if len(img.shape) == 3 and img.shape[2] == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            # 处理Alpha通道（如果有）
-            elif len(img.shape) == 4:
-                img = img[:, :, :3]  # 移除Alpha通道，保留RGB
-
-            # 创建DCM数据集
-            dcm_dataset = create_dcm_dataset(
-                pixel_array=img,
-                series_instance_uid=series_instance_uid,
-                instance_number=idx,
-                pixel_spacing=PIXEL_SPACING,
-                modality=MODALITY
-            )
-
-            # 生成DCM文件名（dcm001.dcm, dcm002.dcm...）
-            dcm_filename = f"{target_format}_{source_format}{idx:0{digit_length}d}.{target_format}"
-            dcm_path = os.path.join(output_folder, dcm_filename)
-
-            # 保存DCM文件（使用Explicit VR Little Endian格式，兼容性最好）
-            dcm_dataset.save_as(dcm_path, write_like_original=False)
-            converted_count += 1
-            print(f"成功：{image_filename} → {dcm_filename}")
-
-        except Exception as e:
-            print(f"失败：{image_filename} → 错误原因：{str(e)}")
-            continue
+    # 生成DCM文件名（dcm001.dcm, dcm002.dcm...）
+    jobs = [
+        (os.path.join(input_folder, image_filename),
+         os.path.join(output_folder, f"{target_format}_{source_format}{idx:0{digit_length}d}.{target_format}"),
+         idx)
+        for idx, image_filename in enumerate(image_files, 1)
+    ]
+
+    # 批量转换图像，按文件顺序打印结果：
+    # 未压缩时线程池并行读图和写盘；RLE编码是纯Python计算，改用进程池按张并行（每个子进程只创建一次writer）
+    converted_count = 0
+    if encode_workers is None:
+        encode_workers = default_encode_workers()
+    if rle and threads > 1 and encode_workers > 1:
+        with ProcessPoolExecutor(max_workers=encode_workers, initializer=init_writers,
+                                 initargs=writer_args) as executor:
+            results = list(executor.map(convert_image_to_dcm, jobs, chunksize=4))
+    else:
+        results = imap_ordered(convert_image_to_dcm, jobs, threads)
+    for message, ok in results:
+        converted_count += ok
+        print(message)
 
     # 输出转换总结
     print(f"PNG/JPG成功转换为DCM！")
@@ -183,7 +231,9 @@ if __name__ == "__main__":
         output_root=OUTPUT_ROOT,
         target_format=TARGET_FORMAT,
         source_format=SOURCE_FORMAT,
-        digit_length=DIGIT_LENGTH
+        digit_length=DIGIT_LENGTH,
+        multiframe=MULTIFRAME,
+        rle=RLE
     )
 
 
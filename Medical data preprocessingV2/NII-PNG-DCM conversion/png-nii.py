@@ -2,13 +2,13 @@
 # -*- coding: utf-8 -*-
 import nibabel as nib
 import numpy as np
-import cv2
 import os
-from glob import glob
+import sys
 import re
 from typing import Optional,Tuple
-def natural_sort_key(s):
-    return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', s)]
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import DEFAULT_IO_THREADS
+from common.volume import read_png_stack, write_nii
 
 def extract_number_from_folder(folder_name: str) -> str:
     # 用正则表达式匹配文件夹名中的所有数字
@@ -25,7 +25,8 @@ def png_to_nii(
         original_nii_path: Optional[str] = None,
         slice_axis: int = 2,
         pixel_spacing: Tuple[float, float, float] = (1.0, 1.0, 1.0),  # 原始空间分辨率（x,y,z轴，单位mm/像素）
-        image_orientation: Tuple[float, ...] = (1, 0, 0, 0, 1, 0)  # DICOM标准方向矩阵（默认横断位）
+        image_orientation: Tuple[float, ...] = (1, 0, 0, 0, 1, 0),  # DICOM标准方向矩阵（默认横断位）
+        threads: int = DEFAULT_IO_THREADS  # 并行解码PNG的线程数（1为串行）
 ) -> None:
     if not os.path.exists(png_dir):
         raise FileNotFoundError(f"PNG文件夹不存在：{png_dir}")
@@ -57,31 +58,10 @@ def png_to_nii(
             final_output_path = os.path.join(png_parent_dir, auto_nii_name)
             print(f"使用默认输出路径（与PNG同级）：{final_output_path}")
 
-    png_files = sorted(glob(os.path.join(png_dir, "*.png")), key=natural_sort_key)
-    if len(png_files) == 0:
-        raise ValueError(f"PNG文件夹中未找到任何.png文件：{png_dir}")
-    print(f"找到 {len(png_files)} 张PNG图片（不检测内部文件名规范）")
-
-    first_png = cv2.imread(png_files[0], cv2.IMREAD_GRAYSCALE)
-    if first_png is None:
-        raise RuntimeError(f"无法读取PNG文件：{png_files[0]}")
-    height, width = first_png.shape
-    slice_count = len(png_files)
-    print(f"读取PNG信息：尺寸{width}×{height}，切片数{slice_count}")
-
-    nii_data = np.zeros(( width,height, slice_count), dtype=np.float32)
-
-    for idx, png_file in enumerate(png_files):
-        png_data = cv2.imread(png_file, cv2.IMREAD_GRAYSCALE)
-        if png_data.shape != (height, width):
-            raise ValueError(
-                f"PNG尺寸不一致：{png_file}（应为{height}x{width}，实际为{png_data.shape[0]}x{png_data.shape[1]}）")
-        if slice_axis == 0:  # x轴堆叠
-            nii_data[idx, :, :] = np.transpose(png_data, (1, 0))
-        elif slice_axis == 1:  # y轴堆叠
-            nii_data[:, idx, :] = np.transpose(png_data, (1, 0))
-        else:  # z轴堆叠（默认）
-            nii_data[:, :, idx] = np.transpose(png_data, (1, 0))
+    # 按自然顺序读取PNG并沿slice_axis堆叠（先按文件头校验尺寸一致，再多线程解码）
+    volume = read_png_stack(png_dir, slice_axis, threads)
+    slice_count = volume.shape[slice_axis]
+    print(f"找到 {slice_count} 张PNG图片（不检测内部文件名规范）")
 
     if original_nii_path and os.path.exists(original_nii_path):
         affine = nib.load(original_nii_path).affine
@@ -102,12 +82,12 @@ def png_to_nii(
         print(f" 像素间距：{pixel_spacing}mm，方向矩阵：{image_orientation}")
 
     # 创建NII图像并保存
-    nii_image = nib.Nifti1Image(nii_data, affine=affine)
-    nib.save(nii_image, final_output_path)
+    volume.affine = affine
+    write_nii(volume, final_output_path)
     print(f"\n PNG已转换成NII！")
     print(f"输入PNG：{png_dir}（共{slice_count}张PNG）")
     print(f"输出NII：{final_output_path}")
-    print(f"NII维度：{nii_data.shape}（x×y×z）")
+    print(f"NII维度：{volume.shape}（x×y×z）")
     print(f"NII像素间距：{pixel_spacing}mm")
     print(f"NII方向矩阵：{image_orientation}")
 
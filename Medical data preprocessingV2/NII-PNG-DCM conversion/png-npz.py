@@ -1,16 +1,22 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import sys
 import numpy as np
 import SimpleITK as sitk
 import cv2
 import pydicom
-from glob import glob
 from typing import Dict,Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import parse_workers, DEFAULT_IO_THREADS
+from common.discovery import DEFAULT_EXTENSIONS, iter_dirs, iter_files
+from common.manifest import BatchManifest, MANIFEST_NAME, iter_incremental
+from common.npy_store import write_npy_store, write_npz_compressed
+from common.png_stack import list_png_files, read_png_slices
 
 def read_single_file(file_path: str) -> np.ndarray:
     # 读取NII文件（.nii/.nii.gz）
-    if file_path.endswith(('.nii', '.nii.gz')):
+    if file_path.lower().endswith(('.nii', '.nii.gz')):
         img = sitk.ReadImage(file_path)
         return sitk.GetArrayFromImage(img)  # 格式：(z,y,x)（3D）
 
@@ -30,8 +36,9 @@ def read_single_file(file_path: str) -> np.ndarray:
 
 def single_file_convert(
         input_path: str,
-        output_path: Optional[str] = None
-) -> None:
+        output_path: Optional[str] = None,
+        output_format: str = "npz"
+) -> str:
     # 自动生成输出路径（同目录+原文件名.npz）
     if output_path is None:
         file_dir = os.path.dirname(input_path)  # 原文件所在目录（输出目录）
@@ -40,54 +47,139 @@ def single_file_convert(
 
     # 读取+保存
     data = read_single_file(input_path)
-    save_to_npz(data, output_path)
+    return save_to_npz(data, output_path, output_format=output_format)
 
 
 def batch_file_convert(
         input_dir: str,
-        target_formats: tuple = ('.nii', '.nii.gz', '.dcm', '.png', '.jpg')
+        target_formats: tuple = DEFAULT_EXTENSIONS,
+        workers: int = 1,
+        output_format: str = "npz",
+        incremental: bool = True,
+        content_hash: bool = False
 ) -> None:
-    total_files = 0
-    success_count = 0
-
-    # 遍历所有目标格式文件
-    for fmt in target_formats:
-        files = glob(os.path.join(input_dir, f'**/*{fmt}'), recursive=True)
-        for file in files:
-            total_files += 1
-            # 自动生成输出路径（同目录+原文件名.npz）
-            file_dir = os.path.dirname(file)
-            file_name = os.path.splitext(os.path.basename(file))[0]
-            output_path = os.path.join(file_dir, file_name)
-
-            try:
-                data = read_single_file(file)
-                save_to_npz(data, output_path)
-                success_count += 1
-            except Exception as e:
-                print(f"抱歉，处理失败")
+    # incremental=True时在输入目录记录清单（.batch_manifest.json），未变化的文件直接跳过
+    manifest = BatchManifest(os.path.join(input_dir, MANIFEST_NAME), content_hash) if incremental else None
+
+    # 只遍历一次目录树（跳过xxx_npy等输出文件夹），边遍历边交给转换；
+    # 输出路径自动生成（同目录+原文件名.npz），workers>1时多进程并行
+    all_files = []
+
+    def work_items():
+        for file, _ in iter_files(input_dir, target_formats):
+            all_files.append(file)
+            yield (file, None, output_format), [file]
+
+    success_count = skipped_count = 0
+    for r in iter_incremental(
+            single_file_convert,
+            work_items(),
+            manifest=manifest,
+            params={"tool": "png-npz", "output_format": output_format},
+            workers=workers
+    ):
+        if r.ok:
+            success_count += 1
+            skipped_count += r.skipped
+        else:
+            print(f"抱歉，处理失败：{all_files[r.index]}")
+    total_files = len(all_files)
 
     # 输出统计信息
     print(f"\n 批量处理完成："
           f"\n共找到{total_files}个文件"
-          f"\n成功转换{success_count}个")
+          f"\n成功转换{success_count}个（其中{skipped_count}个未变化，已跳过）")
+
+def png_folder_to_npz(
+        png_dir: str,
+        output_path: Optional[str] = None,
+        threads: int = DEFAULT_IO_THREADS,
+        compress_level: int = 3
+) -> str:
+    """
+    文件夹模式：把一个xxx_png文件夹里的全部PNG按自然顺序叠成一个NPZ（而不是每张PNG一个NPZ）
+        data         (切片数, 高, 宽)，保留原始类型（8位为uint8，16位灰度为uint16）
+        slice_names  每层对应的PNG文件名，顺序即层号
+    PNG在多个线程中并行解码，直接写入预分配的数组
+    """
+    png_dir = png_dir.rstrip("/\\")
+    if output_path is None:
+        output_path = png_dir  # 与文件夹同级，如 1_png → 1_png.npz
+    if not output_path.endswith('.npz'):
+        output_path += '.npz'
+
+    png_files = list_png_files(png_dir)
+    stack = read_png_slices(png_files, threads=threads)
+    write_npz_compressed(output_path, {
+        "data": stack,
+        "slice_names": np.array([os.path.basename(f) for f in png_files]),
+        "source_type": "png",
+        "source_name": os.path.basename(png_dir)
+    }, compress_level)
+    print(f"输出NPZ文件路径：{output_path}（{stack.shape[0]}张切片，{stack.dtype}）")
+    return output_path
+
+
+def batch_folder_convert(
+        input_dir: str,
+        folder_suffix: str = "_png",
+        workers: int = 1,
+        threads: int = DEFAULT_IO_THREADS,
+        incremental: bool = True,
+        content_hash: bool = False
+) -> None:
+    # 找出input_dir下所有xxx_png文件夹，每个文件夹打包成一个NPZ；workers>1时多个文件夹并行
+    manifest = BatchManifest(os.path.join(input_dir, MANIFEST_NAME), content_hash) if incremental else None
+    all_dirs = []
+
+    def work_items():
+        for png_dir in iter_dirs(input_dir, folder_suffix):
+            all_dirs.append(png_dir)
+            yield (png_dir, None, threads), [png_dir]
+
+    success_count = skipped_count = 0
+    for r in iter_incremental(
+            png_folder_to_npz,
+            work_items(),
+            manifest=manifest,
+            params={"tool": "png-npz-folder"},
+            workers=workers
+    ):
+        if r.ok:
+            success_count += 1
+            skipped_count += r.skipped
+        else:
+            print(f"抱歉，处理失败：{all_dirs[r.index]}（{r.error}）")
+
+    print(f"\n 文件夹打包完成："
+          f"\n共找到{len(all_dirs)}个{folder_suffix}文件夹"
+          f"\n成功转换{success_count}个（其中{skipped_count}个未变化，已跳过）")
+
 
 def save_to_npz(
         data: np.ndarray,
         output_path: str,
-        compress_level: int = 3  # 压缩级别（0-9，越高压缩率越高）
-) -> None:
+        compress_level: int = 3,  # 压缩级别（0-9，越高压缩率越高）
+        output_format: str = "npz"  # npz压缩包 / npy可内存映射的文件夹（xxx_npy/data.npy）
+) -> str:
+    if output_format == "npy":
+        base_path = output_path[:-4] if output_path.endswith('.npz') else output_path
+        output_path = write_npy_store(base_path + "_npy", {"data": data})
+        print(f"输出NPY文件夹路径：{output_path}")
+        return output_path
+
     # 确保输出路径后缀正确
     if not output_path.endswith('.npz'):
         output_path += '.npz'
 
 
-    np.savez_compressed(output_path, data=data, compresslevel=compress_level)
+    write_npz_compressed(output_path, {"data": data}, compress_level)
     print(f"输出NPZ文件路径：{output_path}")
+    return output_path
 
 if __name__ == "__main__":
     # 下面为主函数，根据实际路径修改！
-    # single（单个文件）/ batch（批量文件）
+    # single（单个文件）/ batch（批量文件）/ folder（整个PNG文件夹打包为一个NPZ）
     mode = "single"  # 建议为single
     # 单个文件模式配置
     single_input = "G:\mry1\TOM500\data preprocess\png/1_png/png_dcm008.png"  # 输入文件路径
@@ -96,6 +188,10 @@ if __name__ == "__main__":
     # 批量文件模式配置
     batch_input = "G:\mry1\TOM500\data preprocess\png/1_png"
     batch_output= None   #输出至存储PNG或JPG的输入文件夹
+    workers = parse_workers()  #批量模式的并行进程数，命令行 --workers N
+
+    # 文件夹模式配置：folder_input为单个xxx_png文件夹，或包含多个xxx_png文件夹的根目录
+    folder_input = "G:\mry1\TOM500\data preprocess\png"
 
     try:
         if mode == "single":
@@ -104,7 +200,14 @@ if __name__ == "__main__":
 
         elif mode == "batch":
             print("开始批量文件转换...")
-            batch_file_convert(batch_input,batch_output)
+            batch_file_convert(batch_input, workers=workers)
+
+        elif mode == "folder":
+            print("开始文件夹打包转换...")
+            if folder_input.rstrip("/\\").endswith("_png"):
+                png_folder_to_npz(folder_input)
+            else:
+                batch_folder_convert(folder_input, workers=workers)
 
         print("成功转换为NPZ文件！\n")
 
@@ -0,0 +1,172 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import csv
+import os
+import random
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import read_volume
+from common.batch import run_batch, parse_workers, imap_ordered, DEFAULT_IO_THREADS
+from common.bbox import slice_bboxes
+from common.volume import ensure_dir, strip_ext
+
+# 一条命令生成U-SAM需要的DataV6数据集：
+# DataV6/
+#   ├─ train/train_bbox.csv   每行 [文件名(不含.npz), "[x1, y1, x2, y2]"]
+#   ├─ train/train_npz/       每张切片一个.npz，键为image（0-1浮点）和label（整数标签）
+#   └─ test/...
+# 输入为成对的图像/掩码体数据（NII文件或DICOM序列文件夹），按病例划分train/test，避免同一病例的切片同时出现在两边
+
+CASE_EXTENSIONS = (".nii", ".nii.gz", ".npz", ".vchk")
+
+
+def list_cases(folder: str) -> dict:
+    # 病例名 → 路径：NII等文件按去掉后缀的文件名，DICOM序列按文件夹名
+    cases = {}
+    for entry in os.scandir(folder):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir() or entry.name.lower().endswith(CASE_EXTENSIONS):
+            cases[strip_ext(entry.name)] = entry.path
+    return cases
+
+
+def pair_cases(image_dir: str, mask_dir: str, mask_suffix: str = "") -> List[Tuple[str, str, str]]:
+    # 掩码名 = 图像名 + mask_suffix（如 1.nii.gz ↔ 1_mask.nii.gz 时mask_suffix="_mask"）
+    images = list_cases(image_dir)
+    masks = list_cases(mask_dir)
+    pairs = []
+    for name in sorted(images):
+        mask_path = masks.get(name + mask_suffix)
+        if mask_path is None:
+            print(f"[跳过] 病例{name}没有对应的掩码")
+            continue
+        pairs.append((name, images[name], mask_path))
+    return pairs
+
+
+def split_cases(names: Sequence[str], test_ratio: float = 0.2, seed: int = 0,
+                test_cases: Optional[Sequence[str]] = None) -> set:
+    # 返回划入test的病例名；给出test_cases时直接使用，否则按固定随机种子抽取
+    if test_cases is not None:
+        return set(test_cases)
+    names = sorted(names)
+    random.Random(seed).shuffle(names)
+    return set(names[:int(round(len(names) * test_ratio))])
+
+
+def build_case(
+        case_name: str,
+        image_path: str,
+        mask_path: str,
+        out_npz_dir: str,
+        slice_axis: int = 2,
+        window: Optional[Tuple[float, float]] = None,
+        keep_empty: bool = False,
+        threads: int = DEFAULT_IO_THREADS
+) -> List[list]:
+    """
+    处理一个病例（在子进程中运行）：读图像和掩码，一次算出所有切片的外接框，
+    再在线程池中逐张归一化、写出 病例名_层号.npz，返回该病例的CSV行。
+    window为(下限, 上限)的实际值窗口（如CT的HU窗），None时取整卷的最小/最大值；
+    keep_empty=False时跳过没有前景的切片
+    """
+    image = read_volume(image_path)
+    mask = read_volume(mask_path)
+    if image.shape != mask.shape:
+        raise ValueError(f"图像{image.shape}与掩码{mask.shape}尺寸不一致")
+
+    slope, inter = image.scaling
+    if window is None:
+        lo, hi = float(image.data.min()) * slope + inter, float(image.data.max()) * slope + inter
+    else:
+        lo, hi = float(window[0]), float(window[1])
+    scale = 1.0 / (hi - lo) if hi > lo else 0.0
+
+    boxes, has_fg = slice_bboxes(mask.data, slice_axis)
+    keep = np.arange(len(has_fg)) if keep_empty else np.flatnonzero(has_fg)
+    ensure_dir(out_npz_dir)
+
+    def write_slice(k: int) -> list:
+        index = [slice(None)] * 3
+        index[slice_axis] = k
+        img = image.data[tuple(index)].astype(np.float32)
+        if (slope, inter) != (1.0, 0.0):
+            img = img * slope + inter
+        img -= lo
+        img *= scale
+        np.clip(img, 0.0, 1.0, out=img)
+        label = mask.data[tuple(index)].astype(np.uint8)
+
+        base_name = f"{case_name}_{k:03d}"
+        np.savez_compressed(os.path.join(out_npz_dir, base_name + ".npz"), image=img, label=label)
+        return [base_name, str([int(v) for v in boxes[k]])]
+
+    return list(imap_ordered(write_slice, keep, threads))
+
+
+def build_datav6(
+        image_dir: str,
+        mask_dir: str,
+        out_root: str,
+        mask_suffix: str = "",
+        test_ratio: float = 0.2,
+        seed: int = 0,
+        test_cases: Optional[Sequence[str]] = None,
+        slice_axis: int = 2,
+        window: Optional[Tuple[float, float]] = None,
+        keep_empty: bool = False,
+        workers: int = 1
+) -> None:
+    pairs = pair_cases(image_dir, mask_dir, mask_suffix)
+    if not pairs:
+        print(f"在{image_dir}和{mask_dir}中没有找到成对的病例")
+        return
+    test_set = split_cases([name for name, _, _ in pairs], test_ratio, seed, test_cases)
+    split_of = {name: ("test" if name in test_set else "train") for name, _, _ in pairs}
+
+    # 每个病例一个任务，workers>1时多进程并行（大病例先跑）
+    jobs = [
+        (name, image_path, mask_path,
+         os.path.join(out_root, split_of[name], f"{split_of[name]}_npz"),
+         slice_axis, window, keep_empty)
+        for name, image_path, mask_path in pairs
+    ]
+    results = run_batch(build_case, jobs, workers=workers, size_paths=[p[1] for p in pairs])
+
+    # 所有病例完成后按病例顺序一次写出各自的CSV
+    rows = {"train": [], "test": []}
+    for r in results:
+        name = pairs[r.index][0]
+        if r.ok:
+            rows[split_of[name]].extend(r.value)
+        else:
+            print(f"[失败] 病例{name}：{r.error}")
+    for split, split_rows in rows.items():
+        split_dir = os.path.join(out_root, split)
+        ensure_dir(split_dir)
+        with open(os.path.join(split_dir, f"{split}_bbox.csv"), "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(split_rows)
+
+    n_test = sum(1 for name in split_of if split_of[name] == "test")
+    print(f"DataV6生成完成：{out_root}")
+    print(f"train：{len(pairs) - n_test}个病例，{len(rows['train'])}张切片")
+    print(f"test：{n_test}个病例，{len(rows['test'])}张切片")
+
+
+if __name__ == "__main__":
+    # 根据实际路径修改！
+    IMAGE_DIR = "G:/mry1/TOM500/data preprocess/niioutput/image"  # 图像（NII文件或DICOM序列文件夹）
+    MASK_DIR = "G:/mry1/TOM500/data preprocess/niioutput/mask"  # 掩码，与图像同名（可带后缀）
+    MASK_SUFFIX = ""  # 如掩码为1_mask.nii.gz则填"_mask"
+    OUT_ROOT = "G:/mry1/U-SAM/DataV6"
+    TEST_RATIO = 0.2  # 按病例划分的测试集比例
+    WINDOW = None  # CT可设为HU窗，如(-160, 240)；None为整卷最小/最大值归一化
+    WORKERS = parse_workers()  # 并行进程数，命令行 --workers N
+
+    build_datav6(IMAGE_DIR, MASK_DIR, OUT_ROOT, mask_suffix=MASK_SUFFIX, test_ratio=TEST_RATIO,
+                 window=WINDOW, workers=WORKERS)
@@ -0,0 +1,21 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+# 各转换脚本共用的内存数据结构与读写函数
+from .volume import (
+    Volume,
+    read_volume,
+    write_volume,
+    read_nii,
+    write_nii,
+    read_dicom_series,
+    write_dicom_series,
+    read_png_stack,
+    write_png_stack,
+    read_npz,
+    write_npz,
+    read_npy,
+    write_npy,
+    read_chunked,
+    write_chunked_volume,
+    resample_volume_z,
+)
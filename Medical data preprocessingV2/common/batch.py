@@ -0,0 +1,166 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
+
+# 单个序列内部读文件的默认线程数（I/O密集，可以比CPU核数多）
+DEFAULT_IO_THREADS = min(16, (os.cpu_count() or 1) + 4)
+
+# run_batch/run_stream的子进程中为True：病例已经按进程并行，病例内部不应再按CPU核数开进程池，
+# 线程池也只用平分到本进程的CPU核数（_worker_threads）
+_in_batch_worker = False
+_worker_threads = None
+
+
+def _mark_batch_worker(workers: int = 1):
+    global _in_batch_worker, _worker_threads
+    _in_batch_worker = True
+    _worker_threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+def in_batch_worker() -> bool:
+    return _in_batch_worker
+
+
+def worker_threads(threads: Optional[int]) -> int:
+    # 线程池实际使用的线程数：主进程中即threads，批处理子进程中不超过CPU核数/进程数，
+    # 避免--workers N时出现 N × CPU核数 个线程争抢同一批核
+    threads = threads or 1
+    if _in_batch_worker:
+        return max(1, min(threads, _worker_threads))
+    return threads
+
+
+@dataclass
+class CaseResult:
+    """单个病例的处理结果，index为该病例在输入列表中的位置；skipped表示输入未变、沿用上次的输出"""
+    index: int
+    ok: bool
+    value: Any = None
+    error: str = ""
+    skipped: bool = False
+
+
+def path_size(path: str) -> int:
+    # 文件直接取大小，文件夹（如DICOM序列）累加其下所有文件大小
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _run_case(func: Callable, index: int, args: tuple) -> CaseResult:
+    # 子进程中执行，异常转为结果返回，避免一个病例失败拖垮整批
+    try:
+        return CaseResult(index, True, func(*args))
+    except Exception as e:
+        return CaseResult(index, False, error=str(e))
+
+
+def run_batch(
+        func: Callable,
+        jobs: Sequence[tuple],
+        workers: int = 1,
+        size_paths: Optional[Sequence[str]] = None,
+        on_result: Optional[Callable[[CaseResult], None]] = None
+) -> List[CaseResult]:
+    """
+    通用批处理执行器：
+    - workers<=1 时按输入顺序串行执行，与原来的for循环完全一致
+    - workers>1 时使用进程池，按文件大小从大到小提交（大病例先跑，减少尾部等待）
+    - 无论哪种方式，返回结果都与jobs的输入顺序一致
+    - on_result在主进程中、每个病例完成时立即调用（用于随时记录进度，中断后可续跑）
+    func必须是模块顶层函数（进程池需要pickle）
+    """
+    jobs = [tuple(args) for args in jobs]
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        results = []
+        for i, args in enumerate(jobs):
+            results.append(_run_case(func, i, args))
+            if on_result is not None:
+                on_result(results[-1])
+        return results
+
+    order = list(range(len(jobs)))
+    if size_paths is not None:
+        sizes = [path_size(p) for p in size_paths]
+        order.sort(key=lambda i: sizes[i], reverse=True)
+
+    results: List[Optional[CaseResult]] = [None] * len(jobs)
+    pool_size = min(workers, len(jobs))
+    with ProcessPoolExecutor(max_workers=pool_size, initializer=_mark_batch_worker,
+                             initargs=(pool_size,)) as executor:
+        futures = [executor.submit(_run_case, func, i, jobs[i]) for i in order]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.index] = result
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def run_stream(
+        func: Callable,
+        jobs: Iterable[tuple],
+        workers: int = 1
+) -> Iterator[CaseResult]:
+    """
+    run_batch的流式版本：jobs可以是边遍历目录边产出的生成器，不必先收集完整列表，
+    第一个任务产出后就开始处理。同时在途的任务最多workers*2个，按完成顺序产出结果，
+    CaseResult.index为该任务在jobs中的序号
+    """
+    if workers is None or workers <= 1:
+        for i, args in enumerate(jobs):
+            yield _run_case(func, i, tuple(args))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_mark_batch_worker,
+                             initargs=(workers,)) as executor:
+        pending = set()
+        for i, args in enumerate(jobs):
+            pending.add(executor.submit(_run_case, func, i, tuple(args)))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def imap_ordered(func: Callable, items: Iterable, threads: int = DEFAULT_IO_THREADS) -> Iterator:
+    """
+    在有界线程池上执行func，按输入顺序逐个产出结果。
+    同时在途的任务最多threads*2个，避免一次性把所有结果读进内存；批处理子进程中线程数见worker_threads
+    """
+    threads = worker_threads(threads)
+    if threads <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= threads * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def parse_workers(default: int = 1) -> int:
+    # 供各脚本__main__使用：python xxx.py --workers 8
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", type=int, default=default, help="并行进程数（1为串行）")
+    args, _ = parser.parse_known_args()
+    return args.workers
@@ -0,0 +1,26 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import Tuple
+
+import numpy as np
+
+
+def slice_bboxes(mask: np.ndarray, slice_axis: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    一次性算出掩码每张切片前景的外接框，不逐张循环：
+    把掩码沿切片内两个方向各投影一次（any），每张切片的首尾非零位置就是框的边界。
+    返回 boxes (切片数, 4) int，每行为 [x1, y1, x2, y2]（x为列、y为行，闭区间），
+    以及 has_fg (切片数,) bool；没有前景的切片框为全0
+    """
+    m = np.moveaxis(np.asarray(mask) != 0, slice_axis, 0)  # (切片数, 行, 列)
+    rows = m.any(axis=2)  # (切片数, 行)
+    cols = m.any(axis=1)  # (切片数, 列)
+    has_fg = rows.any(axis=1)
+
+    y1 = rows.argmax(axis=1)
+    y2 = rows.shape[1] - 1 - rows[:, ::-1].argmax(axis=1)
+    x1 = cols.argmax(axis=1)
+    x2 = cols.shape[1] - 1 - cols[:, ::-1].argmax(axis=1)
+    boxes = np.stack([x1, y1, x2, y2], axis=1).astype(np.int64)
+    boxes[~has_fg] = 0
+    return boxes, has_fg
@@ -0,0 +1,212 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import bz2
+import json
+import lzma
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .batch import DEFAULT_IO_THREADS, worker_threads
+
+# 分块体数据容器（.vchk），作为NPZ的替代：
+#   MAGIC(8字节) | 头长度(uint64小端) | JSON头 | 各块压缩数据
+# 每个数组沿slice_axis切成若干slab（默认8张切片一块），每块独立压缩，
+# JSON头里记录每块相对数据区起点的偏移和长度，读取时只解压用到的块
+MAGIC = b"MIVCHK1\n"
+CHUNK_EXT = ".vchk"
+CODECS = ("zlib", "lzma", "bz2", "none")
+
+
+def _compress(raw: bytes, codec: str, level: int) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(raw, level)
+    if codec == "lzma":
+        return lzma.compress(raw, preset=level)
+    if codec == "bz2":
+        return bz2.compress(raw, max(1, level))
+    if codec == "none":
+        return raw
+    raise ValueError(f"不支持的压缩方式：{codec}（可选{CODECS}）")
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    if codec == "bz2":
+        return bz2.decompress(data)
+    if codec == "none":
+        return data
+    raise ValueError(f"不支持的压缩方式：{codec}（可选{CODECS}）")
+
+
+def _map(func, items, threads: int) -> list:
+    # zlib/lzma/bz2压缩解压都会释放GIL，线程池即可并行
+    items = list(items)
+    threads = worker_threads(threads)
+    if threads and threads > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(items))) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def write_chunked(
+        path: str,
+        arrays: Dict[str, np.ndarray],
+        chunk_slices: int = 8,
+        codec: str = "zlib",
+        level: int = 6,
+        slice_axis: int = 2,
+        affine: Optional[np.ndarray] = None,
+        spacing=None,
+        source_type: str = "",
+        source_name: str = "",
+        scaling: Optional[Tuple[float, float]] = None,
+        threads: int = DEFAULT_IO_THREADS
+) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"不支持的压缩方式：{codec}（可选{CODECS}）")
+    if not path.endswith(CHUNK_EXT):
+        path += CHUNK_EXT
+
+    members = {}
+    blobs: List[bytes] = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        axis = slice_axis if array.ndim >= 3 else 0
+        num = array.shape[axis] if array.ndim else 1
+        bounds = [(k, min(k + chunk_slices, num)) for k in range(0, max(num, 1), chunk_slices)]
+
+        def pack(bound, array=array, axis=axis):
+            # 切片轴移到最前，使每个slab在内存中连续
+            slab = np.take(array, range(*bound), axis=axis) if array.ndim else array
+            slab = np.ascontiguousarray(np.moveaxis(slab, axis, 0) if array.ndim else slab)
+            return _compress(slab.tobytes(), codec, level)
+
+        compressed = _map(pack, bounds, threads)
+        chunks = []
+        for (start, stop), blob in zip(bounds, compressed):
+            chunks.append([start, stop, offset, len(blob)])
+            offset += len(blob)
+            blobs.append(blob)
+        members[name] = {
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "slice_axis": axis,
+            "chunks": chunks
+        }
+
+    header = {
+        "codec": codec,
+        "chunk_slices": chunk_slices,
+        "members": members,
+        "affine": np.asarray(affine if affine is not None else np.eye(4)).tolist(),
+        "spacing": [float(s) for s in spacing] if spacing is not None else None,
+        "source_type": source_type,
+        "source_name": source_name
+    }
+    # 整数数据的缩放系数（实际值 = data * scl_slope + scl_inter），为恒等时不写
+    if scaling is not None and tuple(scaling) != (1.0, 0.0):
+        header["scl_slope"], header["scl_inter"] = float(scaling[0]), float(scaling[1])
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    return path
+
+
+class ChunkedVolume:
+    """
+    按块随机读取.vchk文件：
+        vol = ChunkedVolume("G:/.../1.vchk")
+        img = vol.get_slice(40)             # 只解压第40张所在的slab
+        sub = vol.read_slices(32, 64)       # 涉及的slab在多个线程中并行解压
+        full = vol.read()                   # 读全部
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是有效的{CHUNK_EXT}文件：{path}")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+        self.data_start = len(MAGIC) + 8 + header_len
+        self.codec = self.header["codec"]
+        self.affine = np.array(self.header["affine"])
+        self.spacing = tuple(self.header["spacing"]) if self.header.get("spacing") else None
+
+    @property
+    def members(self):
+        return list(self.header["members"])
+
+    def shape(self, name: str = "image"):
+        return tuple(self._member(name)["shape"])
+
+    def slice_axis(self, name: str = "image") -> int:
+        return self._member(name)["slice_axis"]
+
+    def _member(self, name: str) -> dict:
+        if name not in self.header["members"]:
+            raise KeyError(f"{self.path}中没有成员：{name}")
+        return self.header["members"][name]
+
+    def _read_chunk(self, member: dict, chunk) -> np.ndarray:
+        start, stop, offset, length = chunk
+        with open(self.path, "rb") as f:
+            f.seek(self.data_start + offset)
+            raw = _decompress(f.read(length), self.codec)
+        shape = member["shape"]
+        if not shape:
+            return np.frombuffer(raw, dtype=member["dtype"]).reshape(())
+        axis = member["slice_axis"]
+        rest = [s for i, s in enumerate(shape) if i != axis]
+        return np.frombuffer(raw, dtype=member["dtype"]).reshape([stop - start] + rest)
+
+    def read_slices(
+            self,
+            start: int,
+            stop: int,
+            name: str = "image",
+            threads: int = DEFAULT_IO_THREADS
+    ) -> np.ndarray:
+        # 返回沿slice_axis的[start, stop)部分，轴顺序与原数组一致
+        member = self._member(name)
+        axis = member["slice_axis"]
+        shape = member["shape"]
+        start, stop = max(start, 0), min(stop, shape[axis])
+        touched = [c for c in member["chunks"] if c[0] < stop and c[1] > start]
+
+        rest = [s for i, s in enumerate(shape) if i != axis]
+        out = np.empty([max(stop - start, 0)] + rest, dtype=member["dtype"])
+
+        def load(chunk):
+            slab = self._read_chunk(member, chunk)
+            lo, hi = max(start, chunk[0]), min(stop, chunk[1])
+            out[lo - start:hi - start] = slab[lo - chunk[0]:hi - chunk[0]]
+
+        _map(load, touched, threads)
+        return np.moveaxis(out, 0, axis)
+
+    def get_slice(self, k: int, name: str = "image") -> np.ndarray:
+        member = self._member(name)
+        axis = member["slice_axis"]
+        return np.take(self.read_slices(k, k + 1, name, threads=1), 0, axis=axis)
+
+    def read(self, name: str = "image", threads: int = DEFAULT_IO_THREADS) -> np.ndarray:
+        member = self._member(name)
+        if not member["shape"]:
+            return self._read_chunk(member, member["chunks"][0]).copy()
+        return self.read_slices(0, member["shape"][member["slice_axis"]], name, threads)
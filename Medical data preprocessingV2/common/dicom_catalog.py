@@ -0,0 +1,248 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from .batch import DEFAULT_IO_THREADS, worker_threads
+from .dicom_series import SliceHeader, slice_header_from_dataset
+from .discovery import iter_files
+
+# DICOM目录索引：扫描一次根目录（只读头信息），把每个文件的病人、Study、Series、Modality、SOP Class、
+# 路径和几何信息存进本地SQLite。之后按文件大小和修改时间增量刷新，只重新解析变化过的文件；
+# 加载序列、查找RTSTRUCT都直接查表，不再每次解析整个目录。
+# 表中保存绝对路径，整个数据集（或多个数据集）共用一个索引；默认放在用户缓存目录，不写入原始数据目录
+CATALOG_NAME = ".dicom_catalog.sqlite"
+# 可用环境变量DICOM_CATALOG指定索引文件
+CATALOG_ENV = "DICOM_CATALOG"
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".cache", "medimg", "dicom_catalog.sqlite")
+
+# 非图像对象（没有像素，不能作为影像序列读取）
+NON_IMAGE_MODALITIES = ("RTSTRUCT", "RTPLAN", "RTDOSE", "RTRECORD", "SR", "PR", "REG", "SEG", "KO")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    is_dicom INTEGER NOT NULL,
+    patient_id TEXT,
+    study_uid TEXT,
+    series_uid TEXT,
+    modality TEXT,
+    sop_class_uid TEXT,
+    sop_instance_uid TEXT,
+    instance_number INTEGER,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS idx_files_series ON files(series_uid);
+CREATE INDEX IF NOT EXISTS idx_files_patient ON files(patient_id);
+CREATE INDEX IF NOT EXISTS idx_files_modality ON files(modality);
+"""
+
+
+def is_dicom_candidate(name: str) -> bool:
+    # 除隐藏文件外都要尝试：DICOM文件常以UID命名（如1.2.840.113619.2.55.3.604688119），
+    # 不能按扩展名判断；不是DICOM的文件由_parse_file识别并记录，之后不再重复尝试
+    return not name.startswith(".")
+
+
+def _parse_file(job: Tuple[str, int, int]) -> tuple:
+    # 线程池中执行：只读头信息，返回一行记录；不是DICOM的文件也记下来，下次不再尝试
+    path, mtime_ns, size = job
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except (InvalidDicomError, OSError, ValueError, EOFError):
+        return path, os.path.dirname(path), mtime_ns, size, 0, None, None, None, None, None, None, None, None
+    header = slice_header_from_dataset(ds, path)
+    return (
+        path, os.path.dirname(path), mtime_ns, size, 1,
+        str(getattr(ds, "PatientID", "") or ""),
+        str(getattr(ds, "StudyInstanceUID", "") or ""),
+        str(getattr(ds, "SeriesInstanceUID", "") or ""),
+        str(getattr(ds, "Modality", "") or ""),
+        str(getattr(ds, "SOPClassUID", "") or ""),
+        str(getattr(ds, "SOPInstanceUID", "") or ""),
+        header.instance_number,
+        json.dumps(asdict(header))
+    )
+
+
+def _header_from_json(text: str) -> SliceHeader:
+    values = json.loads(text)
+    for key in ("position", "orientation", "pixel_spacing"):
+        if values[key] is not None:
+            values[key] = tuple(values[key])
+    if values["frame_positions"] is not None:
+        values["frame_positions"] = [tuple(p) for p in values["frame_positions"]]
+    return SliceHeader(**values)
+
+
+def sort_series_headers(headers: List[SliceHeader]) -> List[SliceHeader]:
+    # 与GDCM的IPPSorter一致：按ImagePositionPatient在法向上的投影从小到大排序，缺位置信息时按InstanceNumber
+    h0 = headers[0]
+    if h0.orientation and all(h.position is not None for h in headers):
+        orientation = np.array(h0.orientation, dtype=float)
+        normal = np.cross(orientation[:3], orientation[3:])
+        return sorted(headers, key=lambda h: (float(np.dot(h.position, normal)), h.instance_number))
+    return sorted(headers, key=lambda h: h.instance_number)
+
+
+class DicomCatalog:
+    """
+    用法：
+        catalog = DicomCatalog.default()                          # 用户缓存目录中的共用索引
+        catalog = DicomCatalog("D:/cache/tumor.sqlite")           # 或自行指定索引文件
+        catalog.refresh("G:/.../tumor dataset")                   # 首次全量扫描，之后只解析变化的文件
+        for s in catalog.series(folder=case_dir, modality="CT"): ...
+        headers = catalog.series_headers(series_uid)              # 已排好序，可直接read_series_pixels
+        rtstructs = catalog.find_rtstruct(case_dir)
+    """
+
+    def __init__(self, db_path: str, root: Optional[str] = None):
+        self.db_path = db_path
+        # root为refresh()不指定目录时的默认扫描目录（for_root时即数据集根目录）
+        self.root = os.path.abspath(root) if root else None
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        # 多个进程可能同时刷新同一个索引，写锁等待而不是立即报错
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.executescript(_SCHEMA)
+
+    @classmethod
+    def default(cls) -> "DicomCatalog":
+        # 环境变量DICOM_CATALOG指定的索引，否则为 ~/.cache/medimg/dicom_catalog.sqlite
+        return cls(os.environ.get(CATALOG_ENV) or DEFAULT_CATALOG_PATH)
+
+    @classmethod
+    def for_root(cls, root: str) -> "DicomCatalog":
+        # 索引放在数据集根目录下（需要目录可写，适合随数据一起拷贝）
+        return cls(os.path.join(root, CATALOG_NAME), root)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _under(folder: str) -> Tuple[str, list]:
+        # folder本身及其所有子文件夹；用范围比较，可以走dir上的索引
+        folder = os.path.abspath(folder).rstrip("/\\")
+        prefix = folder + os.sep
+        return "(dir = ? OR (dir >= ? AND dir < ?))", [folder, prefix, prefix + "\U0010ffff"]
+
+    def refresh(self, folder: Optional[str] = None, threads: int = DEFAULT_IO_THREADS) -> Tuple[int, int]:
+        """
+        增量刷新folder（默认整个根目录）：大小和修改时间没变的文件不再解析，
+        新增/修改的文件在线程池中只读头信息，已删除的文件从表中移除。返回(重新解析数, 删除数)
+        """
+        if folder is None and self.root is None:
+            raise ValueError("未指定要扫描的目录")
+        folder = os.path.abspath(folder or self.root)
+        where, args = self._under(folder)
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.conn.execute(f"SELECT path, mtime_ns, size FROM files WHERE {where}", args)}
+
+        todo = []
+        seen = set()
+        for path, _ in iter_files(folder, ("",), skip_dir=lambda name: name.startswith(".")):
+            if not is_dicom_candidate(os.path.basename(path)):
+                continue
+            path = os.path.abspath(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            seen.add(path)
+            if known.get(path) != (st.st_mtime_ns, st.st_size):
+                todo.append((path, st.st_mtime_ns, st.st_size))
+        removed = [(path,) for path in known if path not in seen]
+
+        threads = worker_threads(threads)
+        if threads > 1 and len(todo) > 1:
+            with ThreadPoolExecutor(max_workers=min(threads, len(todo))) as executor:
+                rows = list(executor.map(_parse_file, todo))
+        else:
+            rows = [_parse_file(job) for job in todo]
+
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            self.conn.executemany("DELETE FROM files WHERE path = ?", removed)
+        return len(todo), len(removed)
+
+    def series(
+            self,
+            folder: Optional[str] = None,
+            modality: Optional[str] = None,
+            patient_id: Optional[str] = None,
+            images_only: bool = True
+    ) -> List[dict]:
+        # 每个序列一行：series_uid、study_uid、patient_id、modality、文件数、所在文件夹
+        conditions, args = ["is_dicom = 1"], []
+        if folder is not None:
+            where, folder_args = self._under(folder)
+            conditions.append(where)
+            args += folder_args
+        if modality is not None:
+            conditions.append("modality = ?")
+            args.append(modality)
+        if patient_id is not None:
+            conditions.append("patient_id = ?")
+            args.append(patient_id)
+        if images_only:
+            conditions.append(f"modality NOT IN ({','.join('?' * len(NON_IMAGE_MODALITIES))})")
+            args += list(NON_IMAGE_MODALITIES)
+        rows = self.conn.execute(
+            "SELECT series_uid, study_uid, patient_id, modality, COUNT(*), MIN(dir) FROM files "
+            f"WHERE {' AND '.join(conditions)} GROUP BY series_uid ORDER BY MIN(dir), series_uid", args)
+        keys = ("series_uid", "study_uid", "patient_id", "modality", "num_files", "dir")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def main_series(self, folder: str) -> str:
+        # folder中文件最多的影像序列（CT+RTSTRUCT的病例文件夹即CT序列）
+        candidates = self.series(folder=folder)
+        if not candidates:
+            raise RuntimeError(f"目录中未发现DICOM影像序列：{folder}")
+        return max(candidates, key=lambda s: s["num_files"])["series_uid"]
+
+    def series_headers(self, series_uid: str, folder: Optional[str] = None) -> List[SliceHeader]:
+        # 直接由表中保存的头信息还原SliceHeader并排序，不再打开文件
+        sql, args = "SELECT header FROM files WHERE series_uid = ? AND is_dicom = 1", [series_uid]
+        if folder is not None:
+            where, folder_args = self._under(folder)
+            sql += f" AND {where}"
+            args += folder_args
+        headers = [_header_from_json(text) for (text,) in self.conn.execute(sql, args)]
+        if not headers:
+            raise ValueError(f"索引中没有序列：{series_uid}")
+        return sort_series_headers(headers)
+
+    def series_files(self, series_uid: str, folder: Optional[str] = None) -> List[str]:
+        return [h.path for h in self.series_headers(series_uid, folder)]
+
+    def find_rtstruct(self, folder: str) -> List[str]:
+        where, args = self._under(folder)
+        return [path for (path,) in self.conn.execute(
+            f"SELECT path FROM files WHERE modality = 'RTSTRUCT' AND {where} ORDER BY path", args)]
+
+
+def open_catalog(folder: str, catalog: Optional[DicomCatalog] = None,
+                 threads: int = DEFAULT_IO_THREADS) -> DicomCatalog:
+    # 供各加载函数使用：没有传入catalog时使用共用索引（DicomCatalog.default()），并增量刷新folder
+    if catalog is None:
+        catalog = DicomCatalog.default()
+    catalog.refresh(folder, threads=threads)
+    return catalog
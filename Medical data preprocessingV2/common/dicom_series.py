@@ -0,0 +1,281 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+from .batch import DEFAULT_IO_THREADS, worker_threads
+
+
+@dataclass
+class SliceHeader:
+    """
+    单个DICOM文件的头信息（不含像素数据），用于排序和确定体数据几何
+    """
+    path: str
+    instance_number: int
+    position: Optional[Tuple[float, float, float]]  # ImagePositionPatient
+    orientation: Optional[Tuple[float, ...]]  # ImageOrientationPatient（6个元素）
+    pixel_spacing: Optional[Tuple[float, float]]  # (行间距, 列间距)
+    slice_thickness: Optional[float]
+    rows: int
+    columns: int
+    bits_allocated: int
+    bits_stored: int
+    pixel_representation: int
+    samples_per_pixel: int
+    number_of_frames: int
+    transfer_syntax: Optional[str]
+    rescale_slope: float = 1.0
+    rescale_intercept: float = 0.0
+    frame_positions: Optional[List[Tuple[float, float, float]]] = None  # 多帧文件每帧的ImagePositionPatient
+
+    def positions(self) -> List[Optional[Tuple[float, float, float]]]:
+        # 该文件每一帧的位置（单帧文件只有一个）
+        if self.frame_positions is not None:
+            return list(self.frame_positions)
+        return [self.position] * self.number_of_frames
+
+
+def _floats(value) -> Optional[tuple]:
+    return tuple(float(v) for v in value) if value is not None else None
+
+
+def _first_item(ds, keyword: str):
+    sequence = getattr(ds, keyword, None)
+    return sequence[0] if sequence else None
+
+
+def _multiframe_geometry(ds, number_of_frames: int):
+    """
+    多帧DICOM的几何信息在功能组序列中：
+    每帧位置在PerFrameFunctionalGroupsSequence/PlanePositionSequence，
+    方向和像素间距在SharedFunctionalGroupsSequence的PlaneOrientationSequence/PixelMeasuresSequence
+    返回(每帧位置列表或None, 方向或None, 像素间距或None, 层厚或None)
+    """
+    positions = None
+    per_frame = getattr(ds, "PerFrameFunctionalGroupsSequence", None)
+    if per_frame is not None and len(per_frame) == number_of_frames:
+        items = [_first_item(group, "PlanePositionSequence") for group in per_frame]
+        if all(item is not None and "ImagePositionPatient" in item for item in items):
+            positions = [_floats(item.ImagePositionPatient) for item in items]
+
+    shared = _first_item(ds, "SharedFunctionalGroupsSequence")
+    plane = _first_item(shared, "PlaneOrientationSequence") if shared is not None else None
+    measures = _first_item(shared, "PixelMeasuresSequence") if shared is not None else None
+    orientation = _floats(getattr(plane, "ImageOrientationPatient", None)) if plane is not None else None
+    pixel_spacing = _floats(getattr(measures, "PixelSpacing", None)) if measures is not None else None
+    thickness = getattr(measures, "SliceThickness", None) if measures is not None else None
+    return positions, orientation, pixel_spacing, float(thickness) if thickness not in (None, "") else None
+
+
+def read_slice_header(path: str) -> SliceHeader:
+    # stop_before_pixels：只解析到PixelData之前，不读像素
+    return slice_header_from_dataset(pydicom.dcmread(path, stop_before_pixels=True), path)
+
+
+def slice_header_from_dataset(ds, path: str) -> SliceHeader:
+    file_meta = getattr(ds, "file_meta", None)
+    thickness = getattr(ds, "SliceThickness", None)
+    thickness = float(thickness) if thickness not in (None, "") else None
+    orientation = _floats(getattr(ds, "ImageOrientationPatient", None))
+    pixel_spacing = _floats(getattr(ds, "PixelSpacing", None))
+    number_of_frames = int(getattr(ds, "NumberOfFrames", 1) or 1)
+
+    frame_positions = None
+    if number_of_frames > 1:
+        # 顶层没有的几何信息从功能组中补齐
+        frame_positions, mf_orientation, mf_spacing, mf_thickness = _multiframe_geometry(ds, number_of_frames)
+        orientation = orientation or mf_orientation
+        pixel_spacing = pixel_spacing or mf_spacing
+        thickness = thickness if thickness is not None else mf_thickness
+
+    return SliceHeader(
+        path=path,
+        instance_number=int(getattr(ds, "InstanceNumber", 0) or 0),
+        position=_floats(getattr(ds, "ImagePositionPatient", None)),
+        orientation=orientation,
+        pixel_spacing=pixel_spacing,
+        slice_thickness=thickness,
+        rows=int(getattr(ds, "Rows", 0)),
+        columns=int(getattr(ds, "Columns", 0)),
+        bits_allocated=int(getattr(ds, "BitsAllocated", 16)),
+        bits_stored=int(getattr(ds, "BitsStored", 16)),
+        pixel_representation=int(getattr(ds, "PixelRepresentation", 0)),
+        samples_per_pixel=int(getattr(ds, "SamplesPerPixel", 1)),
+        number_of_frames=number_of_frames,
+        transfer_syntax=str(file_meta.TransferSyntaxUID)
+        if file_meta is not None and "TransferSyntaxUID" in file_meta else None,
+        rescale_slope=float(getattr(ds, "RescaleSlope", 1.0)),
+        rescale_intercept=float(getattr(ds, "RescaleIntercept", 0.0)),
+        frame_positions=frame_positions
+    )
+
+
+def list_dicom_files(dcm_folder: str) -> List[str]:
+    return [
+        os.path.join(dcm_folder, f)
+        for f in os.listdir(dcm_folder)
+        if f.lower().endswith(".dcm")
+    ]
+
+
+def scan_dicom_series(
+        dcm_folder: str,
+        files: Optional[Sequence[str]] = None,
+        threads: int = DEFAULT_IO_THREADS,
+        sort: bool = True
+) -> List[SliceHeader]:
+    """
+    只读头信息扫描整个序列，按InstanceNumber排序后返回（sort=False则保持files顺序）。
+    像素数据之后再按这个顺序逐个解码，不需要同时持有所有Dataset。
+    threads>1时在线程池中并发读取，结果顺序与files一致
+    """
+    files = list(files) if files is not None else list_dicom_files(dcm_folder)
+    if not files:
+        raise ValueError(f"没有在{dcm_folder}找到DICOM文件")
+
+    threads = worker_threads(threads)
+    if threads and threads > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(files))) as executor:
+            headers = list(executor.map(read_slice_header, files))
+    else:
+        headers = [read_slice_header(f) for f in files]
+    if sort:
+        headers.sort(key=lambda h: h.instance_number)
+    return headers
+
+
+# 未压缩小端传输语法：PixelData就是原始像素，可以直接按字节视图拷贝
+_RAW_LITTLE_ENDIAN = {str(ExplicitVRLittleEndian), str(ImplicitVRLittleEndian)}
+
+
+def _raw_frame_view(ds, header: SliceHeader) -> Optional[np.ndarray]:
+    """
+    对未压缩小端的灰度数据（单帧或多帧），用np.frombuffer直接得到(帧数, Rows, Columns)的像素视图
+    （不经过pydicom解码），其他情况（压缩、彩色、BitsStored<BitsAllocated需符号扩展等）返回None走pixel_array
+    """
+    if header.transfer_syntax not in _RAW_LITTLE_ENDIAN:
+        return None
+    if header.samples_per_pixel != 1:
+        return None
+    if header.bits_allocated not in (8, 16, 32) or header.bits_stored != header.bits_allocated:
+        return None
+    kind = "i" if header.pixel_representation == 1 else "u"
+    dtype = np.dtype(f"<{kind}{header.bits_allocated // 8}")
+    count = header.number_of_frames * header.rows * header.columns
+    raw = ds.PixelData
+    if len(raw) < count * dtype.itemsize:
+        return None
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(
+        header.number_of_frames, header.rows, header.columns)
+
+
+def stored_dtype(header: SliceHeader) -> np.dtype:
+    # 文件中实际存储的像素类型（未做Rescale）
+    kind = "i" if header.pixel_representation == 1 else "u"
+    return np.dtype(f"{kind}{max(header.bits_allocated, 8) // 8}")
+
+
+def read_series_pixels(
+        headers: Sequence[SliceHeader],
+        dtype=np.int16,
+        threads: int = DEFAULT_IO_THREADS
+) -> np.ndarray:
+    """
+    按头信息预先分配整个体数据 (Rows, Columns, 切片数)，逐个解码并直接写入对应位置，
+    不再生成逐切片的临时数组再np.stack，峰值内存约为1倍体数据大小。
+    多帧文件的各帧依次占用连续的切片位置（一个多帧文件即可是整个序列）。
+    threads>1时多个线程并发读取/解码，每个线程只写自己的切片位置，输出与串行完全一致
+    """
+    h0 = headers[0]
+    for header in headers:
+        if (header.rows, header.columns) != (h0.rows, h0.columns):
+            raise ValueError(
+                f"DICOM尺寸不一致：{header.path}（应为{h0.rows}x{h0.columns}，"
+                f"实际为{header.rows}x{header.columns}）")
+    offsets = np.cumsum([0] + [header.number_of_frames for header in headers])
+    volume = np.empty((h0.rows, h0.columns, int(offsets[-1])), dtype=dtype)
+
+    def load(i: int):
+        header = headers[i]
+        ds = pydicom.dcmread(header.path)
+        frames = _raw_frame_view(ds, header)
+        if frames is None:
+            frames = ds.pixel_array
+            if header.number_of_frames == 1:
+                frames = frames[np.newaxis]
+        volume[:, :, offsets[i]:offsets[i + 1]] = np.moveaxis(frames, 0, -1)
+
+    threads = worker_threads(threads)
+    if threads and threads > 1 and len(headers) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(headers))) as executor:
+            # list()使子线程中的异常在这里抛出
+            list(executor.map(load, range(len(headers))))
+    else:
+        for i in range(len(headers)):
+            load(i)
+
+    return volume
+
+
+def rescale_pixels(pixels: np.ndarray, slope: float, intercept: float) -> np.ndarray:
+    """
+    展开RescaleSlope/RescaleIntercept（与GDCM读取时一致，不一律转为浮点）：
+    斜率和截距都是整数时，按实际取值范围选用int16（放不下时int32），只有非整数斜率/截距才返回float32
+    """
+    if slope == 1.0 and intercept == 0.0:
+        return pixels
+    if float(slope).is_integer() and float(intercept).is_integer() and pixels.size:
+        lo, hi = sorted((float(pixels.min()) * slope + intercept, float(pixels.max()) * slope + intercept))
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if lo >= info.min and hi <= info.max:
+                out = pixels.astype(dtype)
+                if slope != 1.0:
+                    out *= dtype(slope)
+                out += dtype(intercept)
+                return out
+    return pixels.astype(np.float32) * np.float32(slope) + np.float32(intercept)
+
+
+def series_spacing(headers: Sequence[SliceHeader]) -> List[float]:
+    # [行间距, 列间距, 层厚]，与原dcm-npz.py的取法一致
+    h0 = headers[0]
+    pixel_spacing = h0.pixel_spacing or (1.0, 1.0)
+    return [
+        float(pixel_spacing[0]),
+        float(pixel_spacing[1]),
+        float(h0.slice_thickness if h0.slice_thickness is not None else 1.0)
+    ]
+
+
+def series_geometry(headers: Sequence[SliceHeader]):
+    """
+    按DICOM几何计算(origin, spacing, direction)，与SimpleITK的约定一致：
+    spacing为(列间距, 行间距, 层间距)，direction为3x3矩阵，列依次为行方向、列方向、法向
+    """
+    h0 = headers[0]
+    orientation = np.array(h0.orientation if h0.orientation else (1, 0, 0, 0, 1, 0), dtype=float)
+    row_dir, col_dir = orientation[:3], orientation[3:]
+    normal = np.cross(row_dir, col_dir)
+    pixel_spacing = h0.pixel_spacing or (1.0, 1.0)
+
+    positions = [p for h in headers for p in h.positions()]
+    if all(p is not None for p in positions) and len(positions) > 1:
+        proj = np.array(positions, dtype=float) @ normal
+        slice_spacing = float(np.abs(np.diff(proj)).mean()) or 1.0
+        if proj[-1] < proj[0]:
+            normal = -normal
+    else:
+        slice_spacing = float(h0.slice_thickness if h0.slice_thickness else 1.0)
+
+    origin = tuple(float(v) for v in (positions[0] or (0.0, 0.0, 0.0)))
+    spacing = (float(pixel_spacing[1]), float(pixel_spacing[0]), slice_spacing)
+    direction = np.stack([row_dir, col_dir, normal], axis=1)
+    return origin, spacing, direction
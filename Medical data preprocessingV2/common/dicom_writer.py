@@ -0,0 +1,314 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless, generate_uid
+
+try:  # pydicom>=3
+    from pydicom.pixels.encoders import RLELosslessEncoder
+except ImportError:  # pydicom 2.x
+    from pydicom.encoders import RLELosslessEncoder
+
+from .batch import DEFAULT_IO_THREADS, imap_ordered, in_batch_worker
+
+# pydicom自带的RLE编码是纯Python实现，受GIL限制，按帧用进程池并行
+DEFAULT_ENCODE_WORKERS = os.cpu_count() or 1
+
+
+def default_encode_workers() -> int:
+    # 已在run_batch的子进程中（病例间已按进程并行）时为1，避免进程数变成 病例进程数 × CPU核数
+    return 1 if in_batch_worker() else DEFAULT_ENCODE_WORKERS
+
+
+def pixel_format_for(data: np.ndarray) -> Tuple[int, int]:
+    """
+    按数据类型和取值范围选择16位存储方式，返回(BitsAllocated, PixelRepresentation)：
+    能放进int16时为有符号（与原来一致），否则非负且不超过65535时为无符号（如uint16的MR），
+    两者都放不下时报错，不再静默回绕成负数
+    """
+    data = np.asanyarray(data)
+    if np.can_cast(data.dtype, np.int16) or data.size == 0:
+        return 16, 1
+    lo, hi = float(data.min()), float(data.max())
+    if lo >= -32768 and hi <= 32767:
+        return 16, 1
+    if lo >= 0 and hi <= 65535:
+        return 16, 0
+    raise ValueError(f"像素值范围[{lo}, {hi}]超出16位整数能表示的范围，请先缩放（并设置RescaleSlope/Intercept）")
+
+
+def encode_rle_frame(
+        frame: np.ndarray,
+        bits_allocated: int = 16,
+        pixel_representation: int = 1,
+        photometric_interpretation: str = "MONOCHROME2"
+) -> bytes:
+    # 单帧RLE Lossless编码（frame为(Rows, Columns)或(Rows, Columns, 3)），只依赖pydicom
+    return RLELosslessEncoder.encode(
+        frame,
+        encoding_plugin="pydicom",
+        rows=frame.shape[0],
+        columns=frame.shape[1],
+        samples_per_pixel=frame.shape[2] if frame.ndim == 3 else 1,
+        bits_allocated=bits_allocated,
+        bits_stored=bits_allocated,
+        pixel_representation=pixel_representation,
+        photometric_interpretation=photometric_interpretation,
+        planar_configuration=0,
+        number_of_frames=1
+    )
+
+
+def rle_encode_frames(
+        frames: Iterable[np.ndarray],
+        workers: Optional[int] = None,
+        **frame_info
+) -> Iterator[bytes]:
+    # 按输入顺序逐帧产出RLE编码结果；workers>1时在进程池中并行编码，None时见default_encode_workers
+    encode = partial(encode_rle_frame, **frame_info)
+    if workers is None:
+        workers = default_encode_workers()
+    if workers <= 1:
+        for frame in frames:
+            yield encode(frame)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(encode, frames, chunksize=4)
+
+
+class DicomSeriesWriter:
+    """
+    按模板批量写出同一DICOM序列：
+    公共头信息（患者、Study/Series/FrameOfReference UID、像素格式等）只构建一次，
+    每张切片只复制模板并补上InstanceNumber、SOPInstanceUID、Rows/Columns和PixelData，
+    write_series在线程池中并行写盘，write_multiframe把整个体数据写成一个多帧文件。
+    transfer_syntax=RLELossless时像素按帧做RLE无损压缩（encode_workers个进程并行编码，
+    None时为CPU核数，在run_batch子进程中为1），
+    读取端pydicom的pixel_array可直接解码
+    用法：
+        writer = DicomSeriesWriter(modality="CT", pixel_spacing=(0.7, 0.7))
+        writer.write_series((path, slice_array) for ...)
+    多个writer传入相同的study_uid/series_uid/frame_of_reference_uid即可写到同一序列（如灰度和彩色混合）
+    """
+
+    def __init__(
+            self,
+            modality: str = "OT",
+            sop_class_uid: str = pydicom.uid.SecondaryCaptureImageStorage,
+            pixel_spacing: Sequence[float] = (1.0, 1.0),
+            slice_thickness: Optional[float] = None,
+            bits_allocated: int = 16,
+            pixel_representation: int = 1,
+            samples_per_pixel: int = 1,
+            rescale: Tuple[float, float] = (1.0, 0.0),
+            uid_prefix: Optional[str] = None,
+            study_uid: Optional[str] = None,
+            series_uid: Optional[str] = None,
+            frame_of_reference_uid: Optional[str] = None,
+            transfer_syntax: str = ExplicitVRLittleEndian,
+            encode_workers: Optional[int] = None,
+            **tags
+    ):
+        self.uid_prefix = uid_prefix
+        self.sop_class_uid = sop_class_uid
+        self.study_uid = study_uid or self._uid()
+        self.series_uid = series_uid or self._uid()
+        self.frame_of_reference_uid = frame_of_reference_uid or self._uid()
+        self.implementation_uid = self._uid()
+
+        kind = "i" if pixel_representation == 1 else "u"
+        self.dtype = np.dtype(f"<{kind}{bits_allocated // 8}")
+
+        ds = Dataset()
+        ds.SOPClassUID = sop_class_uid
+        ds.StudyInstanceUID = self.study_uid
+        ds.SeriesInstanceUID = self.series_uid
+        ds.FrameOfReferenceUID = self.frame_of_reference_uid
+        ds.Modality = modality
+        ds.SeriesNumber = 1
+        ds.PixelSpacing = [float(s) for s in pixel_spacing]
+        if slice_thickness is not None:
+            ds.SliceThickness = slice_thickness
+        ds.SamplesPerPixel = samples_per_pixel
+        if samples_per_pixel == 3:
+            ds.PhotometricInterpretation = "RGB"
+            ds.PlanarConfiguration = 0
+        else:
+            ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = bits_allocated
+        ds.BitsStored = bits_allocated
+        ds.HighBit = bits_allocated - 1
+        ds.PixelRepresentation = pixel_representation
+        if tuple(rescale) != (1.0, 0.0):
+            ds.RescaleSlope = rescale[0]
+            ds.RescaleIntercept = rescale[1]
+        # 其余公共标签，如PatientName="Anonymous"、StudyDescription=...
+        for keyword, value in tags.items():
+            setattr(ds, keyword, value)
+        self.template = ds
+        self.samples_per_pixel = samples_per_pixel
+        self.bits_allocated = bits_allocated
+        self.pixel_representation = pixel_representation
+        self.transfer_syntax = transfer_syntax
+        self.encode_workers = encode_workers
+
+    @property
+    def rle(self) -> bool:
+        return self.transfer_syntax == RLELossless
+
+    def pixels(self, pixel_array: np.ndarray) -> np.ndarray:
+        # 转为存储类型；不能无损转换的类型先检查取值范围，超出时报错而不是回绕
+        pixel_array = np.asanyarray(pixel_array)
+        if not np.can_cast(pixel_array.dtype, self.dtype) and pixel_array.size:
+            info = np.iinfo(self.dtype)
+            lo, hi = pixel_array.min(), pixel_array.max()
+            if lo < info.min or hi > info.max:
+                raise ValueError(f"像素值范围[{lo}, {hi}]超出存储类型{self.dtype}的范围[{info.min}, {info.max}]")
+        return np.ascontiguousarray(pixel_array, dtype=self.dtype)
+
+    def encode_frames(self, frames: Iterable[np.ndarray]) -> Iterator[bytes]:
+        return rle_encode_frames(
+            (self.pixels(frame) for frame in frames),
+            workers=self.encode_workers,
+            bits_allocated=self.bits_allocated,
+            pixel_representation=self.pixel_representation,
+            photometric_interpretation=str(self.template.PhotometricInterpretation)
+        )
+
+    def multiframe_sop_class(self) -> str:
+        # 多帧文件使用对应的多帧Secondary Capture SOP Class
+        if self.samples_per_pixel == 3:
+            return pydicom.uid.MultiFrameTrueColorSecondaryCaptureImageStorage
+        if self.bits_allocated == 8:
+            return pydicom.uid.MultiFrameGrayscaleByteSecondaryCaptureImageStorage
+        return pydicom.uid.MultiFrameGrayscaleWordSecondaryCaptureImageStorage
+
+    def _uid(self) -> str:
+        return generate_uid(prefix=self.uid_prefix) if self.uid_prefix else generate_uid()
+
+    def make_dataset(
+            self,
+            pixel_array: np.ndarray,
+            instance_number: int,
+            multiframe: bool = False,
+            encoded: Optional[Sequence[bytes]] = None,
+            **tags
+    ) -> FileDataset:
+        # 浅复制模板的每个元素（值对象仍共享，但给某个元素赋值只改本切片的副本，不会改到模板和其他切片，
+        # write_series多线程调用时也互不影响）；
+        # multiframe=True时pixel_array为(帧数, Rows, Columns[, 3])；
+        # encoded为各帧已压缩的数据（RLE），此时PixelData按封装格式写入
+        sop_class_uid = self.multiframe_sop_class() if multiframe else self.sop_class_uid
+        sop_instance_uid = self._uid()
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = sop_class_uid
+        file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+        file_meta.TransferSyntaxUID = self.transfer_syntax if encoded is not None else ExplicitVRLittleEndian
+        file_meta.ImplementationClassUID = self.implementation_uid
+
+        elements = {tag: copy.copy(elem) for tag, elem in self.template.items()}
+        ds = FileDataset("", elements, file_meta=file_meta, preamble=b"\0" * 128,
+                         is_implicit_VR=False, is_little_endian=True)
+        ds.SOPClassUID = sop_class_uid
+        ds.SOPInstanceUID = sop_instance_uid
+        ds.InstanceNumber = instance_number
+        if multiframe:
+            ds.NumberOfFrames = pixel_array.shape[0]
+            ds.Rows, ds.Columns = pixel_array.shape[1:3]
+        else:
+            ds.Rows, ds.Columns = pixel_array.shape[:2]
+        for keyword, value in tags.items():
+            setattr(ds, keyword, value)
+        if encoded is not None:
+            ds.PixelData = encapsulate(list(encoded))
+            ds["PixelData"].VR = "OB"
+            ds["PixelData"].is_undefined_length = True
+        else:
+            ds.PixelData = self.pixels(pixel_array).tobytes()
+        return ds
+
+    def write(
+            self,
+            path: str,
+            pixel_array: np.ndarray,
+            instance_number: int,
+            encoded: Optional[bytes] = None,
+            **tags
+    ) -> str:
+        if encoded is None and self.rle:
+            encoded = encode_rle_frame(
+                self.pixels(pixel_array), self.bits_allocated,
+                self.pixel_representation, str(self.template.PhotometricInterpretation))
+        ds = self.make_dataset(pixel_array, instance_number,
+                               encoded=[encoded] if encoded is not None else None, **tags)
+        ds.save_as(path, write_like_original=False)
+        return path
+
+    def write_series(
+            self,
+            items: Iterable[Tuple[str, np.ndarray]],
+            start: int = 1,
+            threads: int = DEFAULT_IO_THREADS
+    ) -> int:
+        # items逐个产出(输出路径, 切片)，InstanceNumber从start开始依次编号，返回写出张数；
+        # 同时在途的切片最多2*threads张。RLE时先在进程池中按帧编码，再由线程写盘
+        if self.rle:
+            items = list(items)
+            jobs = zip(enumerate(items, start), self.encode_frames(a for _, a in items))
+        else:
+            jobs = ((job, None) for job in enumerate(items, start))
+
+        def task(job):
+            (instance_number, (path, pixel_array)), encoded = job
+            return self.write(path, pixel_array, instance_number, encoded)
+
+        return sum(1 for _ in imap_ordered(task, jobs, threads))
+
+    def write_multiframe(
+            self,
+            path: str,
+            frames: np.ndarray,
+            positions: Optional[Sequence[Sequence[float]]] = None,
+            orientation: Optional[Sequence[float]] = None,
+            instance_number: int = 1
+    ) -> str:
+        """
+        整个体数据写成一个多帧DICOM，frames为(帧数, Rows, Columns[, 3])。
+        像素间距、层厚和方向写入SharedFunctionalGroupsSequence，
+        每帧的ImagePositionPatient写入PerFrameFunctionalGroupsSequence
+        """
+        encoded = list(self.encode_frames(frames)) if self.rle else None
+        ds = self.make_dataset(frames, instance_number, multiframe=True, encoded=encoded)
+
+        shared = Dataset()
+        measures = Dataset()
+        measures.PixelSpacing = self.template.PixelSpacing
+        if "SliceThickness" in self.template:
+            measures.SliceThickness = self.template.SliceThickness
+        shared.PixelMeasuresSequence = [measures]
+        if orientation is not None:
+            plane = Dataset()
+            plane.ImageOrientationPatient = [float(v) for v in orientation]
+            shared.PlaneOrientationSequence = [plane]
+        ds.SharedFunctionalGroupsSequence = [shared]
+
+        if positions is not None:
+            per_frame = []
+            for position in positions:
+                plane = Dataset()
+                plane.ImagePositionPatient = [float(v) for v in position]
+                group = Dataset()
+                group.PlanePositionSequence = [plane]
+                per_frame.append(group)
+            ds.PerFrameFunctionalGroupsSequence = per_frame
+
+        ds.save_as(path, write_like_original=False)
+        return path
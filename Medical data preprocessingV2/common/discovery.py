@@ -0,0 +1,89 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+from .manifest import MANIFEST_NAME
+
+# 批量转换的文件发现：用os.scandir只遍历一次目录树，按扩展名分类后边遍历边产出，
+# 不像每种格式各glob一次那样把整棵树走好几遍，转换也不必等遍历结束才开始
+DEFAULT_EXTENSIONS = (".nii", ".nii.gz", ".dcm", ".png", ".jpg")
+
+# 转换工具自己的输出：xxx_npy文件夹（npy_store）和批处理清单，遍历时跳过
+OUTPUT_DIR_SUFFIXES = ("_npy",)
+
+
+def _longest_first(extensions: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(sorted(extensions, key=len, reverse=True))
+
+
+def match_extension(name: str, extensions: Sequence[str] = _longest_first(DEFAULT_EXTENSIONS)) -> Optional[str]:
+    # extensions需按长度从长到短排列；不区分大小写，复合扩展名优先（a.nii.gz归为.nii.gz而不是.gz）
+    lower = name.lower()
+    for ext in extensions:
+        if lower.endswith(ext.lower()):
+            return ext
+    return None
+
+
+def is_output_dir(name: str) -> bool:
+    return name.startswith(".") or name.endswith(OUTPUT_DIR_SUFFIXES)
+
+
+def iter_files(
+        root: str,
+        extensions: Sequence[str] = DEFAULT_EXTENSIONS,
+        skip_dir: Optional[Callable[[str], bool]] = is_output_dir
+) -> Iterator[Tuple[str, str]]:
+    """
+    深度优先遍历root，逐个产出(文件路径, 匹配到的扩展名)。
+    每个目录只scandir一次，文件类型直接用DirEntry缓存的信息判断，不再逐个stat；
+    同一目录内按名称排序，结果顺序稳定。skip_dir(目录名)为True的子目录整棵跳过
+    """
+    extensions = _longest_first(extensions)
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"无法读取文件夹 {folder}：{e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if skip_dir is None or not skip_dir(entry.name):
+                    subdirs.append(entry.path)
+            elif entry.name != MANIFEST_NAME:
+                ext = match_extension(entry.name, extensions)
+                if ext is not None and entry.is_file():
+                    yield entry.path, ext
+        # 倒序压栈，使子目录按名称顺序处理
+        stack.extend(reversed(subdirs))
+
+
+def iter_dirs(
+        root: str,
+        suffix: str,
+        skip_dir: Optional[Callable[[str], bool]] = is_output_dir
+) -> Iterator[str]:
+    # 同样只遍历一次，逐个产出名称以suffix结尾的文件夹（如xxx_png），不再进入其内部
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted((e for e in it if e.is_dir(follow_symlinks=False)), key=lambda e: e.name)
+        except OSError as e:
+            print(f"无法读取文件夹 {folder}：{e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            if entry.name.endswith(suffix):
+                yield entry.path
+            elif skip_dir is None or not skip_dir(entry.name):
+                subdirs.append(entry.path)
+        stack.extend(reversed(subdirs))
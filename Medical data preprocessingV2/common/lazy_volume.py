@@ -0,0 +1,114 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .batch import DEFAULT_IO_THREADS
+from .chunked_store import CHUNK_EXT, ChunkedVolume
+from .png_stack import _STACK_AXES, list_png_files, read_png_header, read_png_slices, stack_to_volume
+from .volume import Volume, read_volume, spacing_from_affine
+
+
+def axis_index(k, axis: int, ndim: int = 3) -> tuple:
+    # 沿axis取第k张（k也可以是slice）的索引元组，代替各处的 if slice_axis == 0/1/2 分支
+    index = [slice(None)] * ndim
+    index[axis] = k
+    return tuple(index)
+
+
+def take_slice(data: np.ndarray, k: int, axis: int = 2) -> np.ndarray:
+    # 返回视图，不复制
+    return data[axis_index(k, axis, data.ndim)]
+
+
+class LazyVolume:
+    """
+    按需读取切片的体数据，数据保持文件中存储的原始类型（实际值见scaling）：
+        vol = LazyVolume("G:/.../1.nii")
+        img = vol.get_slice(vol.shape[2] // 2, axis=2)
+        sub = vol.get_slices(10, 20, axis=0)
+    能只读需要的字节时就只读这些字节：
+        未压缩.nii、xxx_npy文件夹：内存映射，任意方向取切片都只读用到的部分
+        .vchk：沿存储方向只解压涉及的块
+        xxx_png文件夹：沿堆叠方向只解码对应的PNG
+    其余情况（.nii.gz、NPZ、DICOM序列、跨方向访问.vchk/PNG）第一次访问时整卷解码一次并缓存
+    """
+
+    def __init__(self, path: str, png_slice_axis: int = 2, threads: int = DEFAULT_IO_THREADS):
+        self.path = path.rstrip("/\\")
+        self.threads = threads
+        self._volume: Optional[Volume] = None
+        self._chunked: Optional[ChunkedVolume] = None
+        self._png_files = None
+        self.png_slice_axis = png_slice_axis
+
+        if self.path.lower().endswith(CHUNK_EXT):
+            self._chunked = ChunkedVolume(self.path)
+        elif os.path.isdir(self.path) and self.path.lower().endswith("_png"):
+            self._png_files = list_png_files(self.path)
+
+    @property
+    def volume(self) -> Volume:
+        # 整卷（缓存）；NII/NPY通过read_volume得到的本身就是内存映射，不会真的读入
+        if self._volume is None:
+            if self._png_files is not None:
+                self._volume = read_volume(self.path, slice_axis=self.png_slice_axis, threads=self.threads)
+            else:
+                self._volume = read_volume(self.path)
+        return self._volume
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        if self._volume is None and self._chunked is not None:
+            return self._chunked.shape()
+        if self._volume is None and self._png_files:
+            h, w = read_png_header(self._png_files[0])[:2]
+            # 与stack_to_volume一致：(切片数, 高, 宽)按png_slice_axis转置后的形状
+            stack_shape = (len(self._png_files), h, w)
+            return tuple(stack_shape[i] for i in _STACK_AXES[self.png_slice_axis])
+        return self.volume.shape
+
+    @property
+    def affine(self) -> np.ndarray:
+        if self._volume is None and self._chunked is not None:
+            return self._chunked.affine
+        return self.volume.affine
+
+    @property
+    def spacing(self):
+        if self._volume is None and self._chunked is not None:
+            return self._chunked.spacing or spacing_from_affine(self._chunked.affine)
+        return self.volume.spacing
+
+    @property
+    def scaling(self) -> Tuple[float, float]:
+        if self._volume is None and self._chunked is not None:
+            header = self._chunked.header
+            return float(header.get("scl_slope", 1.0)), float(header.get("scl_inter", 0.0))
+        if self._volume is None and self._png_files is not None:
+            return 1.0, 0.0
+        return self.volume.scaling
+
+    def num_slices(self, axis: int = 2) -> int:
+        return self.shape[axis]
+
+    def get_slices(self, start: int, stop: int, axis: int = 2) -> np.ndarray:
+        # 沿axis的[start, stop)部分，轴顺序与整卷一致
+        if self._volume is None:
+            if self._chunked is not None and axis == self._chunked.slice_axis():
+                return self._chunked.read_slices(start, stop, threads=self.threads)
+            if self._png_files is not None and axis == self.png_slice_axis:
+                stack = read_png_slices(self._png_files[max(start, 0):stop], threads=self.threads)
+                return stack_to_volume(stack, axis)
+        return self.volume.data[axis_index(slice(start, stop), axis, self.volume.data.ndim)]
+
+    def get_slice(self, k: int, axis: int = 2) -> np.ndarray:
+        if k < 0:
+            k += self.num_slices(axis)
+        return take_slice(self.get_slices(k, k + 1, axis), 0, axis)
+
+    def middle_slice(self, axis: int = 2) -> Tuple[int, np.ndarray]:
+        k = self.num_slices(axis) // 2
+        return k, self.get_slice(k, axis)
@@ -0,0 +1,213 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import itertools
+import json
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .batch import CaseResult, run_batch, run_stream
+
+# 增量批处理清单：记录每个病例输入的指纹（大小、修改时间、可选内容哈希）、转换参数和输出，
+# 再次运行时输入和参数都没变、输出也还在的病例直接跳过。每完成一个病例就写一次清单，中断后可续跑
+MANIFEST_NAME = ".batch_manifest.json"
+
+
+def _iter_files(path: str):
+    # 文件夹（如DICOM序列）按相对路径排序逐个产出其中的文件
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for f in sorted(files):
+            yield os.path.join(root, f)
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    for file_path in _iter_files(path):
+        if os.path.isdir(path):
+            digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path: str) -> Dict[str, int]:
+    # 文件取大小和修改时间；文件夹取文件数、总大小和最新修改时间
+    count = size = mtime = 0
+    for file_path in _iter_files(path):
+        st = os.stat(file_path)
+        count += 1
+        size += st.st_size
+        mtime = max(mtime, st.st_mtime_ns)
+    return {"count": count, "size": size, "mtime": mtime}
+
+
+class BatchManifest:
+    """
+    用法（一般通过run_incremental使用）：
+        manifest = BatchManifest("G:/.../niioutput/.batch_manifest.json")
+        if manifest.lookup([dcm_folder], params) is None:
+            ...转换...
+            manifest.record([dcm_folder], params, output_path)
+    content_hash=True时大小或修改时间变了还会再比较内容哈希（如整体拷贝过的数据），内容相同也视为未变
+    """
+
+    def __init__(self, manifest_path: str, content_hash: bool = False):
+        self.path = manifest_path
+        self.content_hash = content_hash
+        self.entries = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                # 清单损坏时当作空清单，全部重做
+                self.entries = {}
+
+    @staticmethod
+    def _key(inputs: Sequence[str], params: dict) -> str:
+        return json.dumps([params.get("tool", ""), [os.path.abspath(p) for p in inputs]], ensure_ascii=False)
+
+    @staticmethod
+    def _normalize(params: dict) -> dict:
+        return json.loads(json.dumps(params, ensure_ascii=False, default=str))
+
+    def _input_state(self, path: str, with_hash: bool) -> dict:
+        state = fingerprint(path)
+        if with_hash:
+            state["sha1"] = content_hash(path)
+        return state
+
+    def lookup(self, inputs: Sequence[str], params: dict) -> Optional[List[str]]:
+        # 输入、参数都没变且输出都还在时返回上次的输出列表，否则返回None
+        entry = self.entries.get(self._key(inputs, params))
+        if entry is None or entry.get("params") != self._normalize(params):
+            return None
+        if not all(os.path.exists(p) for p in entry.get("outputs", [])):
+            return None
+        touched = False
+        for path in inputs:
+            old = entry["inputs"].get(os.path.abspath(path))
+            if old is None or not os.path.exists(path):
+                return None
+            new = fingerprint(path)
+            if all(old.get(k) == v for k, v in new.items()):
+                continue
+            if not (self.content_hash and old.get("sha1") and old["sha1"] == content_hash(path)):
+                return None
+            # 内容没变只是时间变了：更新指纹，下次不必再算哈希
+            old.update(new)
+            touched = True
+        if touched:
+            self.save()
+        return entry.get("outputs", [])
+
+    def record(self, inputs: Sequence[str], params: dict, outputs) -> None:
+        if outputs is None:
+            outputs = []
+        elif isinstance(outputs, str):
+            outputs = [outputs]
+        self.entries[self._key(inputs, params)] = {
+            "inputs": {os.path.abspath(p): self._input_state(p, self.content_hash) for p in inputs},
+            "params": self._normalize(params),
+            "outputs": [os.path.abspath(p) for p in outputs]
+        }
+        self.save()
+
+    def save(self) -> None:
+        # 先写临时文件再替换，写到一半被中断也不会留下损坏的清单
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def run_incremental(
+        func: Callable,
+        jobs: Sequence[tuple],
+        inputs: Sequence[Sequence[str]],
+        manifest: Optional[BatchManifest],
+        params: Optional[dict] = None,
+        workers: int = 1,
+        size_paths: Optional[Sequence[str]] = None
+) -> List[CaseResult]:
+    """
+    在run_batch外加一层清单：inputs[i]为jobs[i]依赖的输入路径，params为影响输出的转换参数，
+    func的返回值作为该病例的输出路径（字符串或列表）记入清单。
+    已是最新的病例不再执行，返回skipped=True的结果；返回结果仍与jobs的顺序一致。
+    manifest为None时与run_batch完全相同
+    """
+    jobs = [tuple(args) for args in jobs]
+    if manifest is None:
+        return run_batch(func, jobs, workers=workers, size_paths=size_paths)
+    params = params or {}
+
+    results: List[Optional[CaseResult]] = [None] * len(jobs)
+    pending = []
+    for i in range(len(jobs)):
+        outputs = manifest.lookup(inputs[i], params)
+        if outputs is not None:
+            results[i] = CaseResult(i, True, outputs, skipped=True)
+        else:
+            pending.append(i)
+
+    def on_result(result: CaseResult):
+        if result.ok:
+            manifest.record(inputs[pending[result.index]], params, result.value)
+
+    sub_results = run_batch(
+        func,
+        [jobs[i] for i in pending],
+        workers=workers,
+        size_paths=[size_paths[i] for i in pending] if size_paths is not None else None,
+        on_result=on_result
+    )
+    for result in sub_results:
+        result.index = pending[result.index]
+        results[result.index] = result
+    return results
+
+
+def iter_incremental(
+        func: Callable,
+        items: Iterable[Tuple[tuple, Sequence[str]]],
+        manifest: Optional[BatchManifest],
+        params: Optional[dict] = None,
+        workers: int = 1
+) -> Iterator[CaseResult]:
+    """
+    run_incremental的流式版本：items逐个产出(func的参数, 该任务依赖的输入路径)，
+    已是最新的任务直接产出skipped=True的结果，其余交给run_stream边产出边处理。
+    结果按完成顺序产出，CaseResult.index为该任务在items中的序号
+    """
+    params = params or {}
+    # run_stream给出的序号 -> (在items中的序号, 输入路径)
+    pending_inputs: Dict[int, Tuple[int, Sequence[str]]] = {}
+    skipped: List[CaseResult] = []
+    job_ids = itertools.count()
+
+    def jobs():
+        # run_stream每取一个任务，这里才检查下一个输入，已最新的先攒着随结果一起产出
+        for i, (args, inputs) in enumerate(items):
+            outputs = manifest.lookup(inputs, params) if manifest is not None else None
+            if outputs is not None:
+                skipped.append(CaseResult(i, True, outputs, skipped=True))
+                continue
+            pending_inputs[next(job_ids)] = (i, inputs)
+            yield args
+
+    for result in run_stream(func, jobs(), workers=workers):
+        while skipped:
+            yield skipped.pop(0)
+        index, inputs = pending_inputs.pop(result.index)
+        result.index = index
+        if result.ok and manifest is not None:
+            manifest.record(inputs, params, result.value)
+        yield result
+    while skipped:
+        yield skipped.pop(0)
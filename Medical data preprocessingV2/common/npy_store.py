@@ -0,0 +1,134 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import zipfile
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# 每个病例一个文件夹（如 1_npy/），内含未压缩的 image.npy、label.npy 等成员，
+# 以及记录affine、spacing等信息的 meta.json。成员用 np.load(mmap_mode='r') 打开，
+# 取一张切片只读这一张切片的字节，不需要像NPZ那样先解压整个image
+META_NAME = "meta.json"
+
+
+def write_npz_compressed(output_path: str, arrays: Dict[str, np.ndarray], compress_level: int = 6) -> str:
+    # 与np.savez_compressed格式相同（np.load直接读取），但可以指定zlib压缩级别（0-9，越低越快）；
+    # np.savez_compressed不接受压缩级别，多余的关键字参数会被当成一个数组存进去
+    with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compress_level) as zf:
+        for name, value in arrays.items():
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(value), allow_pickle=False)
+    return output_path
+
+
+def _slice_layout(array: np.ndarray, slice_axis: int) -> np.ndarray:
+    # 让沿slice_axis的每张切片在文件中连续存放：z轴用Fortran顺序，x轴用C顺序
+    if array.ndim == 3 and slice_axis == 2:
+        return np.asfortranarray(array)
+    return np.ascontiguousarray(array)
+
+
+def write_npy_store(
+        out_dir: str,
+        arrays: Dict[str, np.ndarray],
+        affine: Optional[np.ndarray] = None,
+        spacing=None,
+        source_type: str = "",
+        source_name: str = "",
+        scaling: Optional[Tuple[float, float]] = None,
+        slice_axis: int = 2
+) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    members = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        np.save(os.path.join(out_dir, f"{name}.npy"), _slice_layout(array, slice_axis))
+        members[name] = {"shape": list(array.shape), "dtype": str(array.dtype)}
+
+    meta = {
+        "members": members,
+        "affine": np.asarray(affine if affine is not None else np.eye(4)).tolist(),
+        "spacing": [float(s) for s in spacing] if spacing is not None else None,
+        "source_type": source_type,
+        "source_name": source_name,
+        "slice_axis": slice_axis
+    }
+    # 整数数据的缩放系数（实际值 = data * scl_slope + scl_inter），为恒等时不写
+    if scaling is not None and tuple(scaling) != (1.0, 0.0):
+        meta["scl_slope"], meta["scl_inter"] = float(scaling[0]), float(scaling[1])
+    with open(os.path.join(out_dir, META_NAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return out_dir
+
+
+class NpyStore:
+    """
+    读取write_npy_store写出的病例文件夹，所有数组都是只读内存映射
+    用法：
+        store = NpyStore("G:/.../1_npy")
+        img = store.get_slice(40)              # 第40张切片（视图，不复制）
+        lab = store.get_slice(40, "label")
+    """
+
+    def __init__(self, store_dir: str):
+        self.path = store_dir
+        with open(os.path.join(store_dir, META_NAME), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.affine = np.array(self.meta["affine"])
+        self.spacing = tuple(self.meta["spacing"]) if self.meta.get("spacing") else None
+        self.slice_axis = int(self.meta.get("slice_axis", 2))
+        self._arrays = {}
+
+    @property
+    def members(self):
+        return list(self.meta["members"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            if name not in self.meta["members"]:
+                raise KeyError(f"{self.path}中没有成员：{name}")
+            self._arrays[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    def num_slices(self, name: str = "image") -> int:
+        return self[name].shape[self.slice_axis]
+
+    def get_slice(self, k: int, name: str = "image", axis: Optional[int] = None) -> np.ndarray:
+        array = self[name]
+        index = [slice(None)] * array.ndim
+        index[self.slice_axis if axis is None else axis] = k
+        return array[tuple(index)]
+
+
+def npz_to_npy_store(npz_path: str, out_dir: Optional[str] = None, slice_axis: int = 2) -> str:
+    """
+    把已有的NPZ（dcm-npz/nii-npz/png-npz的输出）转换为npy文件夹，
+    数值数组成为.npy成员，affine/spacing/source_type/source_name写入meta.json
+    """
+    if out_dir is None:
+        out_dir = os.path.splitext(npz_path)[0] + "_npy"
+
+    arrays = {}
+    info = {}
+    with np.load(npz_path) as npz:
+        for key in npz.files:
+            value = npz[key]
+            if key in ("affine", "spacing"):
+                info[key] = value
+            elif value.ndim == 0:
+                info[key] = value.item()
+            else:
+                arrays[key] = value
+
+    return write_npy_store(
+        out_dir,
+        arrays,
+        affine=info.get("affine"),
+        spacing=info.get("spacing"),
+        source_type=str(info.get("source_type", "npz")),
+        source_name=str(info.get("source_name", os.path.basename(npz_path))),
+        scaling=(info.get("scl_slope", 1.0), info.get("scl_inter", 0.0)),
+        slice_axis=slice_axis
+    )
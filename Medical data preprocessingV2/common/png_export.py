@@ -0,0 +1,133 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import threading
+from typing import Iterable, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from .batch import imap_ordered
+
+# cv2.imencode和numpy的大块运算都会释放GIL，编码线程数取CPU核数即可（run_batch子进程中由imap_ordered按进程数平分）
+DEFAULT_ENCODE_THREADS = os.cpu_count() or 1
+
+
+def slice_min_max(data: np.ndarray, slice_axis: int = 2, per_slice: bool = True):
+    """
+    一次轴向归约得到每张切片的(min, max)；per_slice=False时整卷共用一个(min, max)
+    """
+    slice_num = data.shape[slice_axis]
+    if not per_slice:
+        return np.full(slice_num, data.min()), np.full(slice_num, data.max())
+    axes = tuple(a for a in range(data.ndim) if a != slice_axis)
+    return data.min(axis=axes), data.max(axis=axes)
+
+
+def scale_to_uint8(
+        slice_data: np.ndarray,
+        lo,
+        hi,
+        out: np.ndarray,
+        scratch: np.ndarray,
+        flat_to_zero: bool = False
+) -> np.ndarray:
+    """
+    把slice_data按[lo, hi]线性映射到0-255写入out（uint8），scratch为复用的float64缓冲区。
+    数值与 ((s - lo) / (hi - lo) * 255).astype(np.uint8) 完全一致。
+    hi<=lo时：flat_to_zero=True输出全0（dcm-png的做法），否则直接截断为uint8（nii-png的做法）
+    """
+    if hi > lo:
+        np.subtract(slice_data, lo, out=scratch, dtype=np.float64)
+        scratch /= float(hi) - float(lo)
+        scratch *= 255
+        np.copyto(out, scratch, casting="unsafe")
+    elif flat_to_zero:
+        out.fill(0)
+    else:
+        np.copyto(out, slice_data, casting="unsafe")
+    return out
+
+
+def encode_image(path: str, img: np.ndarray, params: Optional[Sequence[int]] = None) -> bool:
+    # imencode+写文件与cv2.imwrite输出相同，且支持中文路径
+    ok, buf = cv2.imencode(os.path.splitext(path)[1], img, list(params) if params else [])
+    if ok:
+        with open(path, "wb") as f:
+            f.write(buf.tobytes())
+    return bool(ok)
+
+
+class _Buffers(threading.local):
+    # 每个编码线程各自复用一组缓冲区
+    def get(self, shape):
+        if getattr(self, "shape", None) != shape:
+            self.shape = shape
+            self.out = np.empty(shape, dtype=np.uint8)
+            self.scratch = np.empty(shape, dtype=np.float64)
+        return self.out, self.scratch
+
+
+def _take_view(data: np.ndarray, i: int, axis: int) -> np.ndarray:
+    index = [slice(None)] * data.ndim
+    index[axis] = i
+    return data[tuple(index)]
+
+
+def export_volume_png(
+        data: np.ndarray,
+        out_paths: Sequence[str],
+        slice_axis: int = 2,
+        per_slice: bool = True,
+        flat_to_zero: bool = False,
+        threads: int = DEFAULT_ENCODE_THREADS,
+        params: Optional[Sequence[int]] = None,
+        desc: Optional[str] = None
+) -> int:
+    """
+    整卷导出：min/max一次归约算好，各切片在线程池中归一化+编码+写盘，返回成功张数。
+    进度只通过一个tqdm进度条汇总显示（desc为None时不显示）
+    """
+    slice_num = data.shape[slice_axis]
+    if len(out_paths) != slice_num:
+        raise ValueError(f"输出文件数{len(out_paths)}与切片数{slice_num}不一致")
+    mins, maxs = slice_min_max(data, slice_axis, per_slice)
+    buffers = _Buffers()
+
+    def task(i: int) -> bool:
+        slice_data = _take_view(data, i, slice_axis)
+        out, scratch = buffers.get(slice_data.shape)
+        scale_to_uint8(slice_data, mins[i], maxs[i], out, scratch, flat_to_zero)
+        return encode_image(out_paths[i], out, params)
+
+    results = imap_ordered(task, range(slice_num), threads)
+    return sum(tqdm(results, total=slice_num, desc=desc, disable=desc is None))
+
+
+def export_slices_png(
+        items: Iterable[Tuple[str, np.ndarray]],
+        total: Optional[int] = None,
+        flat_to_zero: bool = False,
+        normalize_dtypes: Optional[Sequence] = None,
+        threads: int = DEFAULT_ENCODE_THREADS,
+        params: Optional[Sequence[int]] = None,
+        desc: Optional[str] = None
+) -> int:
+    """
+    流式导出：items按顺序逐个产出(输出路径, 切片)（如iter_nii_slices），每张用自身的min/max归一化，
+    normalize_dtypes给出时只归一化这些类型的切片，其余类型原样编码（如dcm-png只归一化uint16/int16/浮点）。主线程取切片，编码线程并行处理，
+    同时在内存中的切片数不超过2*threads，返回成功张数
+    """
+    buffers = _Buffers()
+
+    def task(item) -> bool:
+        path, slice_data = item
+        if normalize_dtypes is not None and slice_data.dtype not in normalize_dtypes:
+            return encode_image(path, slice_data, params)
+        out, scratch = buffers.get(slice_data.shape)
+        scale_to_uint8(slice_data, slice_data.min(), slice_data.max(), out, scratch, flat_to_zero)
+        return encode_image(path, out, params)
+
+    results = imap_ordered(task, items, threads)
+    return sum(tqdm(results, total=total, desc=desc, disable=desc is None))
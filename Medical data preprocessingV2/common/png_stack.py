@@ -0,0 +1,87 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .batch import DEFAULT_IO_THREADS, worker_threads
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def natural_sort_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+
+def list_png_files(png_dir: str) -> List[str]:
+    # 只列一次目录、排一次序（自然顺序：2.png在10.png之前）
+    names = [entry.name for entry in os.scandir(png_dir)
+             if entry.is_file() and entry.name.lower().endswith(".png")]
+    names.sort(key=natural_sort_key)
+    return [os.path.join(png_dir, name) for name in names]
+
+
+def read_png_header(path: str) -> Tuple[int, int, int, int]:
+    """
+    只读PNG文件开头的IHDR块（前24字节左右），不解码像素，
+    返回(高, 宽, 位深, 颜色类型)；颜色类型0为灰度，2为RGB，4/6带透明通道
+    """
+    with open(path, "rb") as f:
+        head = f.read(26)
+    if len(head) < 26 or head[:8] != _PNG_SIGNATURE or head[12:16] != b"IHDR":
+        raise ValueError(f"不是有效的PNG文件：{path}")
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", head[16:26])
+    return height, width, bit_depth, color_type
+
+
+def read_png_slices(png_files: Sequence[str], threads: int = DEFAULT_IO_THREADS) -> np.ndarray:
+    """
+    把一组PNG按顺序解码为 (切片数, 高, 宽) 的灰度数组：
+    先只读各文件头校验尺寸一致，再按需要的类型（8位为uint8，16位灰度为uint16）预分配，
+    多个线程并行解码，每个线程直接写入自己那一层
+    """
+    if not png_files:
+        raise ValueError("没有需要读取的PNG文件")
+    headers = [read_png_header(f) for f in png_files]
+    height, width, bit_depth, color_type = headers[0]
+    for png_file, header in zip(png_files, headers):
+        if header[:2] != (height, width):
+            raise ValueError(
+                f"PNG尺寸不一致：{png_file}（应为{height}x{width}，实际为{header[0]}x{header[1]}）")
+
+    # 16位灰度保留原始精度，其余按原来的方式转为8位灰度
+    if bit_depth == 16 and color_type == 0:
+        dtype, flags = np.uint16, cv2.IMREAD_ANYDEPTH
+    else:
+        dtype, flags = np.uint8, cv2.IMREAD_GRAYSCALE
+    stack = np.empty((len(png_files), height, width), dtype=dtype)
+
+    def load(idx: int):
+        png_data = cv2.imread(png_files[idx], flags)
+        if png_data is None:
+            raise RuntimeError(f"无法读取PNG文件：{png_files[idx]}")
+        stack[idx] = png_data
+
+    threads = worker_threads(threads)
+    if threads and threads > 1 and len(png_files) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(png_files))) as executor:
+            # list()使子线程中的异常在这里抛出
+            list(executor.map(load, range(len(png_files))))
+    else:
+        for idx in range(len(png_files)):
+            load(idx)
+    return stack
+
+
+# stack[idx, 行, 列]按slice_axis放到体数据中的轴顺序（每张PNG都转置，与原来逐张np.transpose一致）
+_STACK_AXES = {0: (0, 2, 1), 1: (2, 0, 1), 2: (2, 1, 0)}
+
+
+def stack_to_volume(stack: np.ndarray, slice_axis: int = 2) -> np.ndarray:
+    # 只返回转置视图，不复制数据
+    return stack.transpose(_STACK_AXES[slice_axis])
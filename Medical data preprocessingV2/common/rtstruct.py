@@ -0,0 +1,275 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import pydicom
+
+from .batch import DEFAULT_IO_THREADS, worker_threads
+
+# RTSTRUCT轮廓栅格化：方向矩阵只求一次逆，每条轮廓的全部点用一次矩阵乘法转换到体素坐标，
+# 多边形只在其外接框大小的小块上填充，再直接合并进目标切片
+
+CONTOUR_DATA_TAG = 0x30060050
+# 解析RTSTRUCT只需要这些顶层元素，其余（如成千上万条参考SOP）直接跳过
+RTSTRUCT_TAGS = ["SpecificCharacterSet", "StructureSetROISequence", "ROIContourSequence",
+                 "RTROIObservationsSequence"]
+# 按(路径, 修改时间, 大小)缓存最近解析过的RTSTRUCT
+RTSTRUCT_CACHE_SIZE = 16
+
+
+def parse_contour_data(raw: bytes) -> np.ndarray:
+    # ContourData的原始字节（以反斜杠分隔的DS十进制串）一次性转换为(N, 3)的float64
+    return np.array(raw.split(b"\\"), dtype=np.float64).reshape(-1, 3)
+
+
+def contour_points(item) -> np.ndarray:
+    """
+    ContourSequence中一项的ContourData：尚未被访问过时pydicom保存的是原始字节（RawDataElement），
+    直接整体解析，不再逐个生成DSfloat对象；已被转换过的退回到普通取值
+    """
+    raw = item.get_item(CONTOUR_DATA_TAG)
+    if raw is None:
+        return np.empty((0, 3))
+    value = raw.value
+    if isinstance(value, (bytes, bytearray)):
+        return parse_contour_data(bytes(value))
+    return np.asarray(item.ContourData, dtype=np.float64).reshape(-1, 3)
+
+
+class RTStructFile:
+    """
+    RTSTRUCT的ROI与轮廓，轮廓按ROI在第一次用到时才解析，没用到的ROI不解码
+        rs = read_rtstruct("G:/.../RS.dcm")
+        rs.roi_names                      # {ROI编号: 名称}
+        rs.select(r"^gtv")                # 名称匹配正则（不区分大小写）的ROI编号
+        rs.contours(2)                    # [(N, 3) float64, ...]
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        ds = pydicom.dcmread(path, specific_tags=RTSTRUCT_TAGS)
+        self.roi_names: Dict[int, str] = {
+            int(roi.ROINumber): str(roi.ROIName) for roi in getattr(ds, "StructureSetROISequence", [])
+        }
+        self._items = {}
+        for roi_contour in getattr(ds, "ROIContourSequence", []):
+            self._items.setdefault(int(roi_contour.ReferencedROINumber), []).extend(
+                getattr(roi_contour, "ContourSequence", []))
+        self._contours: Dict[int, List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def select(self, pattern: Optional[str] = None, numbers: Optional[Sequence[int]] = None) -> List[int]:
+        # 按名称正则和/或编号挑选ROI，保持StructureSetROISequence中的顺序
+        regex = re.compile(pattern, re.IGNORECASE) if pattern is not None else None
+        return [
+            number for number, name in self.roi_names.items()
+            if (regex is None or regex.search(name)) and (numbers is None or number in numbers)
+        ]
+
+    def contours(self, roi_number: int) -> List[np.ndarray]:
+        # 不同ROI可在多个线程中同时解析，锁只保护缓存字典
+        with self._lock:
+            if roi_number in self._contours:
+                return self._contours[roi_number]
+        parsed = [contour_points(item) for item in self._items.get(roi_number, [])]
+        with self._lock:
+            return self._contours.setdefault(roi_number, parsed)
+
+
+_rtstruct_cache: "OrderedDict[tuple, RTStructFile]" = OrderedDict()
+_rtstruct_cache_lock = threading.Lock()
+
+
+def read_rtstruct(path: str) -> RTStructFile:
+    # 同一文件（路径、修改时间、大小都相同）再次读取时直接返回缓存的解析结果
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _rtstruct_cache_lock:
+        if key in _rtstruct_cache:
+            _rtstruct_cache.move_to_end(key)
+            return _rtstruct_cache[key]
+    rtstruct = RTStructFile(path)
+    with _rtstruct_cache_lock:
+        _rtstruct_cache[key] = rtstruct
+        while len(_rtstruct_cache) > RTSTRUCT_CACHE_SIZE:
+            _rtstruct_cache.popitem(last=False)
+    return rtstruct
+
+
+def image_geometry(sitk_img) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # SimpleITK图像的(origin, spacing, direction 3x3)，均按(x, y, z)顺序
+    return (
+        np.array(sitk_img.GetOrigin(), dtype=float),
+        np.array(sitk_img.GetSpacing(), dtype=float),
+        np.array(sitk_img.GetDirection(), dtype=float).reshape(3, 3)
+    )
+
+
+def world_to_voxels(
+        points: np.ndarray,
+        origin: np.ndarray,
+        spacing: np.ndarray,
+        inv_direction: np.ndarray
+) -> np.ndarray:
+    # (N, 3)物理坐标(mm) → (N, 3)连续体素坐标(x, y, z)；inv_direction为方向矩阵的逆（预先求好）
+    return (np.asarray(points, dtype=float) - origin) @ inv_direction.T / spacing
+
+
+def voxel_polygons(
+        contours: Iterable[np.ndarray],
+        origin: Sequence[float],
+        spacing: Sequence[float],
+        direction: np.ndarray,
+        volume_shape: Tuple[int, int, int]
+) -> Dict[int, List[np.ndarray]]:
+    # 每条轮廓转换为体素坐标下的(N, 2) int32多边形(x, y)，按层号分组；层号取第一个点（轴向轮廓所有点在同一层），
+    # 落在体数据之外的层丢弃
+    origin = np.asarray(origin, dtype=float)
+    spacing = np.asarray(spacing, dtype=float)
+    inv_direction = np.linalg.inv(np.asarray(direction, dtype=float).reshape(3, 3))
+    depth = volume_shape[0]
+    slices: Dict[int, List[np.ndarray]] = {}
+    for points in contours:
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if len(points) == 0:
+            continue
+        voxels = world_to_voxels(points, origin, spacing, inv_direction)
+        z_index = int(np.rint(voxels[0, 2]))
+        if not 0 <= z_index < depth:
+            continue
+        slices.setdefault(z_index, []).append(np.rint(voxels[:, :2]).astype(np.int32))
+    return slices
+
+
+def polygon_area(polygon: np.ndarray) -> float:
+    # 鞋带公式求多边形面积（体素数的近似），用于按大小排序ROI
+    x, y = polygon[:, 0].astype(float), polygon[:, 1].astype(float)
+    return 0.5 * abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+
+
+def fill_slice(target: np.ndarray, polygons: Iterable[np.ndarray], mode: str = "or", value: int = 1) -> np.ndarray:
+    # 把同一层的多边形逐个在外接框（裁到target范围内）大小的小块上填充，再按mode合并进target (H, W)
+    height, width = target.shape
+    for polygon in polygons:
+        x0, y0 = np.maximum(polygon.min(axis=0), 0)
+        x1, y1 = np.minimum(polygon.max(axis=0) + 1, (width, height))
+        if x1 <= x0 or y1 <= y0:
+            continue
+        patch = np.zeros((y1 - y0, x1 - x0), dtype=target.dtype)
+        cv2.fillPoly(patch, [(polygon - (x0, y0)).astype(np.int32)], value)
+        region = target[y0:y1, x0:x1]
+        if mode == "xor":
+            np.bitwise_xor(region, patch, out=region)
+        else:
+            np.bitwise_or(region, patch, out=region)
+    return target
+
+
+def rasterize_contours(
+        contours: Iterable[np.ndarray],
+        origin: Sequence[float],
+        spacing: Sequence[float],
+        direction: np.ndarray,
+        volume_shape: Tuple[int, int, int],
+        mode: str = "or",
+        out: Optional[np.ndarray] = None,
+        value: int = 1
+) -> np.ndarray:
+    """
+    把一组轮廓（每条为(N, 3)的ContourData物理坐标）填充到(Z, Y, X)的mask中。
+    mode="or"（默认）：所有轮廓直接取并集，与原extract_gtv_mask的结果一致；
+    mode="xor"：同一层上的轮廓按奇偶规则合并，嵌套在外轮廓里的轮廓成为空洞（需要时显式指定）。
+    out可传入已有的mask，value为填充值
+    """
+    if mode not in ("xor", "or"):
+        raise ValueError(f"不支持的填充方式：{mode}（可选xor/or）")
+    if out is None:
+        out = np.zeros(volume_shape, dtype=np.uint8)
+    for z_index, polygons in voxel_polygons(contours, origin, spacing, direction, volume_shape).items():
+        fill_slice(out[z_index], polygons, mode, value)
+    return out
+
+
+def extract_roi_labelmap(
+        rtstruct_path: str,
+        sitk_img,
+        volume_shape: Tuple[int, int, int],
+        pattern: Optional[str] = None,
+        numbers: Optional[Sequence[int]] = None,
+        output: str = "labelmap",
+        mode: str = "or",
+        threads: int = DEFAULT_IO_THREADS
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    一次读取RTSTRUCT，把选中的全部ROI（名称匹配正则pattern，和/或ROI编号在numbers中；都为None时全选）
+    写入一个结果数组，返回(结果, {ROI名称: 标签})。各ROI的轮廓在线程池中并行解析、转换为体素多边形：
+    output="labelmap"：(Z, Y, X)标签图，标签按选中顺序为1, 2, ...，重叠处取面积较小的ROI
+    （每层按轮廓面积从大到小依次写入，GTV⊂CTV⊂Body这类嵌套结构不会被外层覆盖）。
+    按层并行直接写入标签图，每层只用一块外接框大小的临时缓冲，峰值内存不随ROI数增加；
+    output="planes"：(ROI数, Z, Y, X)的0/1平面，第i个平面对应标签i+1，重叠区域各自保留
+    """
+    if output not in ("labelmap", "planes"):
+        raise ValueError(f"不支持的输出方式：{output}（可选labelmap/planes）")
+    if mode not in ("xor", "or"):
+        raise ValueError(f"不支持的填充方式：{mode}（可选xor/or）")
+    rtstruct = read_rtstruct(rtstruct_path)
+    selected = rtstruct.select(pattern, numbers)
+    if not selected:
+        raise ValueError(f"RTSTRUCT中没有符合条件的ROI：{rtstruct_path}")
+
+    table = {}
+    for label, number in enumerate(selected, start=1):
+        name = rtstruct.roi_names[number]
+        table[name if name not in table else f"{name}_{number}"] = label
+
+    origin, spacing, direction = image_geometry(sitk_img)
+    threads = worker_threads(threads)
+    executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    pool_map = executor.map if executor is not None else map
+    try:
+        rois = list(pool_map(
+            lambda number: voxel_polygons(rtstruct.contours(number), origin, spacing, direction, volume_shape),
+            selected))
+
+        if output == "planes":
+            planes = np.zeros((len(rois),) + tuple(volume_shape), dtype=np.uint8)
+
+            def fill_roi(i: int) -> None:
+                for z_index, polygons in rois[i].items():
+                    fill_slice(planes[i, z_index], polygons, mode)
+
+            list(pool_map(fill_roi, range(len(rois))))
+            return planes, table
+
+        labelmap = np.zeros(volume_shape, dtype=np.uint8 if len(selected) < 256 else np.uint16)
+        areas = [sum(polygon_area(p) for polygons in roi.values() for p in polygons) for roi in rois]
+        order = sorted(range(len(rois)), key=lambda i: -areas[i])
+        height, width = volume_shape[1:]
+
+        def paint_slice(z_index: int) -> None:
+            for i in order:
+                polygons = rois[i].get(z_index)
+                if not polygons:
+                    continue
+                # 只在该ROI本层所有多边形的外接框上填充，再写入标签
+                stacked = np.concatenate(polygons)
+                x0, y0 = np.maximum(stacked.min(axis=0), 0)
+                x1, y1 = np.minimum(stacked.max(axis=0) + 1, (width, height))
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                scratch = fill_slice(np.zeros((y1 - y0, x1 - x0), dtype=np.uint8),
+                                     [p - (x0, y0) for p in polygons], mode)
+                labelmap[z_index, y0:y1, x0:x1][scratch != 0] = i + 1
+
+        list(pool_map(paint_slice, sorted(set().union(*rois))))
+        return labelmap, table
+    finally:
+        if executor is not None:
+            executor.shutdown()
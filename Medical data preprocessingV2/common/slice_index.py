@@ -0,0 +1,263 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+
+from .bbox import slice_bboxes
+from .discovery import iter_files
+
+# 前景切片索引：转换标签体数据（如肿瘤掩码）时顺带写出一个小JSON，记录哪些切片含有哪些标签、
+# 每个标签的体素数和前景外接框。训练采样、质检只读这个文件就能挑出病灶切片，不用逐张加载
+#   切片文件夹（xxx_png、xxx_npy）：文件夹内的 slice_index.json
+#   单个文件（1.npz、1.vchk）：同目录的 1.npz.slice_index.json
+SLICE_INDEX_NAME = "slice_index.json"
+SLICE_INDEX_EXT = ".slice_index.json"
+
+# 不同取值超过这么多的整数体数据视为图像而不是标签，不生成索引
+MAX_LABELS = 64
+
+
+def index_path_for(output_path: str) -> str:
+    output_path = output_path.rstrip("/\\")
+    if os.path.isdir(output_path):
+        return os.path.join(output_path, SLICE_INDEX_NAME)
+    return output_path + SLICE_INDEX_EXT
+
+
+def compute_slice_index(
+        data: np.ndarray,
+        slice_axis: int = 2,
+        force: bool = False,
+        max_labels: int = MAX_LABELS
+) -> Optional[dict]:
+    """
+    整卷一次计算：全部标签值、每个标签在每张切片上的体素数（每个标签一次轴向求和），
+    以及每张切片的前景外接框（slice_bboxes）。只记录有前景的切片。
+    非整数或取值过多（像是图像）时返回None；force=True时浮点数据四舍五入后照样计算
+    """
+    data = np.asanyarray(data)
+    if data.dtype.kind == "f":
+        if not force:
+            return None
+        data = np.rint(data).astype(np.int64)
+    elif data.dtype.kind not in "biu":
+        return None
+
+    if not force:
+        # 先在稀疏采样上粗查，明显是图像的数据不必对整卷做unique
+        sample = data[tuple(slice(None, None, 4) for _ in range(data.ndim))]
+        if len(np.unique(sample)) > max_labels + 1:
+            return None
+    labels = [int(v) for v in np.unique(data) if v != 0]
+    if len(labels) > max_labels and not force:
+        return None
+
+    m = np.moveaxis(data, slice_axis, 0)
+    axes = tuple(range(1, m.ndim))
+    counts = {label: np.count_nonzero(m == label, axis=axes) for label in labels}
+    boxes, has_fg = slice_bboxes(data, slice_axis)
+
+    slices = {}
+    for k in np.flatnonzero(has_fg):
+        slices[str(int(k))] = {
+            "counts": {str(label): int(c[k]) for label, c in counts.items() if c[k]},
+            "bbox": [int(v) for v in boxes[k]]
+        }
+    return {
+        "shape": [int(s) for s in data.shape],
+        "slice_axis": slice_axis,
+        "num_slices": int(data.shape[slice_axis]),
+        "labels": labels,
+        "slices": slices
+    }
+
+
+class SliceIndexBuilder:
+    """
+    流式导出时逐张累计切片索引，结果与compute_slice_index相同，但不需要整卷数据：
+        builder = SliceIndexBuilder(slice_num, slice_axis)
+        for k, s in enumerate(slices): builder.add(k, s)     # 或作为write_png_stack_from_nii的on_slice
+        index = builder.result()
+    一旦发现不像标签的数据（非整数，或不同取值超过max_labels）就停止统计，之后的add直接返回，result()为None
+    """
+
+    def __init__(self, num_slices: int, slice_axis: int = 2, force: bool = False, max_labels: int = MAX_LABELS):
+        self.num_slices = num_slices
+        self.slice_axis = slice_axis
+        self.force = force
+        self.max_labels = max_labels
+        self.active = True
+        self._slice_shape = None
+        self._labels = set()
+        self._slices = {}
+
+    def add(self, k: int, slice_data: np.ndarray) -> None:
+        if not self.active:
+            return
+        s = np.asarray(slice_data)
+        if s.dtype.kind == "f":
+            if not self.force:
+                self.active = False
+                return
+            s = np.rint(s).astype(np.int64)
+        elif s.dtype.kind not in "biu":
+            self.active = False
+            return
+        self._slice_shape = s.shape
+
+        values, counts = np.unique(s, return_counts=True)
+        fg = values != 0
+        self._labels.update(int(v) for v in values[fg])
+        if len(self._labels) > self.max_labels and not self.force:
+            self.active = False
+            return
+        if not fg.any():
+            return
+        # 与slice_bboxes相同：x为切片内第二个方向（列），y为第一个方向（行）
+        rows = np.flatnonzero(s.any(axis=1))
+        cols = np.flatnonzero(s.any(axis=0))
+        self._slices[str(int(k))] = {
+            "counts": {str(int(v)): int(c) for v, c in zip(values[fg], counts[fg])},
+            "bbox": [int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])]
+        }
+
+    def result(self) -> Optional[dict]:
+        if not self.active or self._slice_shape is None:
+            return None
+        shape = list(self._slice_shape)
+        shape.insert(self.slice_axis, self.num_slices)
+        return {
+            "shape": [int(v) for v in shape],
+            "slice_axis": self.slice_axis,
+            "num_slices": int(self.num_slices),
+            "labels": sorted(self._labels),
+            "slices": dict(sorted(self._slices.items(), key=lambda item: int(item[0])))
+        }
+
+
+def index_from_nii(nii_path: str, slice_axis: int = 2, force: bool = False) -> Optional[dict]:
+    # 逐张读取切片累计（不读入整卷）；存储类型为浮点（不是标签）时直接返回None，图像数据读到第一张就会停止
+    img = nib.load(nii_path)
+    if img.get_data_dtype().kind == "f" and not force:
+        return None
+    proxy = img.dataobj
+    builder = SliceIndexBuilder(proxy.shape[slice_axis], slice_axis, force)
+    index = [slice(None)] * len(proxy.shape)
+    for k in range(builder.num_slices):
+        index[slice_axis] = k
+        builder.add(k, np.asarray(proxy[tuple(index)]))
+        if not builder.active:
+            return None
+    return builder.result()
+
+
+def write_slice_index(index: Optional[dict], output_path: str) -> Optional[str]:
+    # index为None（不是标签数据）时什么都不写
+    if index is None:
+        return None
+    path = index_path_for(output_path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return path
+
+
+class SliceIndex:
+    """
+    单个病例的切片索引
+        idx = SliceIndex.load("G:/.../1_png")       # 或索引文件本身的路径
+        idx.foreground_slices(label=1, min_voxels=20)
+        idx.bbox(40)
+    """
+
+    def __init__(self, index: dict, path: str = ""):
+        self.path = path
+        self.index = index
+        self.slice_axis = index["slice_axis"]
+        self.num_slices = index["num_slices"]
+        self.labels = index["labels"]
+        self._slices = {int(k): v for k, v in index["slices"].items()}
+
+    @classmethod
+    def load(cls, path: str) -> "SliceIndex":
+        if not path.endswith((SLICE_INDEX_NAME, SLICE_INDEX_EXT)):
+            path = index_path_for(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), path)
+
+    @property
+    def case_path(self) -> str:
+        # 索引对应的输出（切片文件夹或文件）
+        if self.path.endswith(SLICE_INDEX_EXT):
+            return self.path[:-len(SLICE_INDEX_EXT)]
+        return os.path.dirname(self.path)
+
+    def counts(self, k: int) -> Dict[int, int]:
+        entry = self._slices.get(k)
+        return {int(label): c for label, c in entry["counts"].items()} if entry else {}
+
+    def bbox(self, k: int) -> Optional[List[int]]:
+        entry = self._slices.get(k)
+        return entry["bbox"] if entry else None
+
+    def foreground_slices(self, label: Optional[int] = None, min_voxels: int = 1) -> List[int]:
+        if label is None:
+            return sorted(k for k, v in self._slices.items() if sum(v["counts"].values()) >= min_voxels)
+        key = str(label)
+        return sorted(k for k, v in self._slices.items() if v["counts"].get(key, 0) >= min_voxels)
+
+    def empty_slices(self) -> List[int]:
+        return [k for k in range(self.num_slices) if k not in self._slices]
+
+
+class DatasetSliceIndex:
+    """
+    整个数据集的切片索引：遍历root一次读入所有病例的索引，查询结果按条件缓存，
+    之后每次随机抽取都是O(1)
+        ds = DatasetSliceIndex("G:/.../png")
+        ds.lesion_slices(label=1)          # [(病例输出路径, 层号), ...]
+        ds.sample(16, label=1)             # 随机抽16张病灶切片
+        ds.sample(16, empty=True)          # 随机抽16张空切片
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.cases: List[SliceIndex] = []
+        for path, _ in iter_files(root, (SLICE_INDEX_NAME, SLICE_INDEX_EXT),
+                                  skip_dir=lambda name: name.startswith(".")):
+            self.cases.append(SliceIndex.load(path))
+        self._cache: Dict[Tuple, List[Tuple[str, int]]] = {}
+
+    def __len__(self):
+        return len(self.cases)
+
+    def lesion_slices(self, label: Optional[int] = None, min_voxels: int = 1) -> List[Tuple[str, int]]:
+        key = ("fg", label, min_voxels)
+        if key not in self._cache:
+            self._cache[key] = [(case.case_path, k) for case in self.cases
+                                for k in case.foreground_slices(label, min_voxels)]
+        return self._cache[key]
+
+    def empty_slices(self) -> List[Tuple[str, int]]:
+        key = ("empty",)
+        if key not in self._cache:
+            self._cache[key] = [(case.case_path, k) for case in self.cases for k in case.empty_slices()]
+        return self._cache[key]
+
+    def sample(
+            self,
+            n: int,
+            label: Optional[int] = None,
+            min_voxels: int = 1,
+            empty: bool = False,
+            rng: Optional[random.Random] = None
+    ) -> List[Tuple[str, int]]:
+        pool = self.empty_slices() if empty else self.lesion_slices(label, min_voxels)
+        if not pool:
+            return []
+        rng = rng or random
+        return [pool[rng.randrange(len(pool))] for _ in range(n)]
@@ -0,0 +1,490 @@
+#!/user/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+import SimpleITK as sitk
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless
+
+from .batch import DEFAULT_IO_THREADS
+from .dicom_writer import DicomSeriesWriter, pixel_format_for
+from .dicom_catalog import DicomCatalog
+from .dicom_series import list_dicom_files, scan_dicom_series, series_spacing, read_series_pixels, stored_dtype
+from .png_export import DEFAULT_ENCODE_THREADS, export_volume_png, export_slices_png
+from .npy_store import META_NAME, NpyStore, write_npy_store
+from .chunked_store import CHUNK_EXT, ChunkedVolume, write_chunked
+from .png_stack import list_png_files, natural_sort_key, read_png_slices, stack_to_volume
+
+
+@dataclass
+class Volume:
+    """
+    内存中的三维体数据，所有读写函数都返回或接收它，
+    这样 DICOM → 重采样 → PNG → NPZ 之类的转换链只需解码一次、编码一次。
+    data的轴顺序与affine一致：(x, y, z)，对DICOM即(Rows, Columns, 切片)
+    """
+    data: np.ndarray
+    affine: np.ndarray = field(default_factory=lambda: np.eye(4))
+    spacing: Tuple[float, float, float] = (1.0, 1.0, 1.0)
+    source_type: str = ""
+    source_name: str = ""
+    meta: dict = field(default_factory=dict)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def scaling(self) -> Tuple[float, float]:
+        # (slope, intercept)：NIfTI的scl_slope/scl_inter或DICOM的RescaleSlope/RescaleIntercept，
+        # 实际值 = data * slope + intercept，data本身保持文件中存储的原始类型
+        return float(self.meta.get("scl_slope", 1.0)), float(self.meta.get("scl_inter", 0.0))
+
+    def as_float(self, dtype=np.float32) -> np.ndarray:
+        # 需要实际物理值（如HU）时才展开为浮点
+        slope, inter = self.scaling
+        data = self.data.astype(dtype)
+        if (slope, inter) != (1.0, 0.0):
+            data *= slope
+            data += inter
+        return data
+
+
+def ensure_dir(path: str):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+
+def spacing_from_affine(affine: np.ndarray) -> Tuple[float, float, float]:
+    # 体素间距即affine各列方向向量的长度
+    return (
+        float(np.linalg.norm(affine[:3, 0])),
+        float(np.linalg.norm(affine[:3, 1])),
+        float(np.linalg.norm(affine[:3, 2]))
+    )
+
+
+def strip_ext(path: str) -> str:
+    # 去掉后缀，兼容.nii.gz双重后缀（如"1.nii.gz"→"1"）
+    name = os.path.basename(path.rstrip("/\\"))
+    if name.lower().endswith(".nii.gz"):
+        return name[:-7]
+    return os.path.splitext(name)[0]
+
+
+# ---------------- NII ----------------
+def read_nii(nii_path: str, dtype=None) -> Volume:
+    """
+    默认保留文件中存储的原始类型（int16的CT、uint8的掩膜等），scl_slope/scl_inter记入meta，
+    写回NII时原样带回；dtype不为None（如np.float32）时才按get_fdata展开为缩放后的浮点数据
+    """
+    img = nib.load(nii_path)
+    affine = img.affine
+    meta = {}
+    if dtype is None:
+        data = np.asarray(img.dataobj.get_unscaled())
+        if (img.dataobj.slope, img.dataobj.inter) != (1.0, 0.0):
+            meta = {"scl_slope": float(img.dataobj.slope), "scl_inter": float(img.dataobj.inter)}
+    else:
+        data = img.get_fdata(dtype=dtype)
+    return Volume(
+        data=data,
+        affine=affine,
+        spacing=spacing_from_affine(affine),
+        source_type="nii",
+        source_name=os.path.basename(nii_path),
+        meta=meta
+    )
+
+
+def write_nii(volume: Volume, output_path: str) -> str:
+    ensure_dir(os.path.dirname(output_path) or ".")
+    img = nib.Nifti1Image(volume.data, volume.affine)
+    slope, inter = volume.scaling
+    if (slope, inter) != (1.0, 0.0):
+        img.header.set_slope_inter(slope, inter)
+    nib.save(img, output_path)
+    return output_path
+
+
+# ---------------- DICOM序列 ----------------
+def read_dicom_series(
+        dcm_folder: str,
+        threads: int = DEFAULT_IO_THREADS,
+        catalog: Optional[DicomCatalog] = None
+) -> Volume:
+    # 先只读头信息排序，再按最终顺序解码像素，直接写入预分配的体数据；threads为并发读文件的线程数
+    # 像素保持文件中存储的类型，RescaleSlope/RescaleIntercept记入meta而不是直接展开为浮点
+    # 传入catalog（DicomCatalog）时头信息直接从索引中取，不再逐个解析文件
+    if catalog is not None:
+        catalog.refresh(dcm_folder, threads=threads)
+        headers = catalog.series_headers(catalog.main_series(dcm_folder), dcm_folder)
+        headers.sort(key=lambda h: h.instance_number)
+    else:
+        headers = scan_dicom_series(dcm_folder, threads=threads)
+    volume = read_series_pixels(headers, dtype=stored_dtype(headers[0]), threads=threads)
+    meta = {"slice_files": [os.path.basename(h.path) for h in headers]}
+    if (headers[0].rescale_slope, headers[0].rescale_intercept) != (1.0, 0.0):
+        meta["scl_slope"] = headers[0].rescale_slope
+        meta["scl_inter"] = headers[0].rescale_intercept
+
+    spacing = series_spacing(headers)
+    affine = np.diag([spacing[1], spacing[0], spacing[2], 1.0])
+
+    return Volume(
+        data=volume,
+        affine=affine,
+        spacing=tuple(spacing),
+        source_type="dcm",
+        source_name=os.path.basename(dcm_folder.rstrip("/\\")),
+        meta=meta
+    )
+
+
+def dicom_frame_geometry(affine: np.ndarray, num_slices: int):
+    """
+    由(x, y, z)体数据的affine（RAS）得到按z切片写DICOM时的几何信息（LPS）：
+    每张切片的行对应x、列对应y，返回(PixelSpacing, 层厚, ImageOrientationPatient, 每张切片的ImagePositionPatient)
+    """
+    spacing = spacing_from_affine(affine)
+    row_dir = _RAS_TO_LPS @ affine[:3, 1] / spacing[1]  # 沿一行（列号增加）的方向
+    col_dir = _RAS_TO_LPS @ affine[:3, 0] / spacing[0]  # 沿一列（行号增加）的方向
+    positions = [_RAS_TO_LPS @ (affine[:3, 3] + k * affine[:3, 2]) for k in range(num_slices)]
+    return [spacing[0], spacing[1]], spacing[2], list(row_dir) + list(col_dir), positions
+
+
+def write_dicom_series(
+        volume: Volume,
+        output_folder: str,
+        prefix: str = "dcm_nii",
+        threads: int = DEFAULT_IO_THREADS,
+        multiframe: bool = False,
+        rle: bool = False,
+        encode_workers: Optional[int] = None
+) -> int:
+    """
+    沿z轴逐切片写出，文件名如dcm_nii001.dcm；整个序列共用一份头信息模板和同一组Study/Series UID，
+    各切片在线程池中并行写盘。
+    multiframe=True时整个体数据写成一个多帧文件（如dcm_nii.dcm），并按affine写入每帧的位置和方向；
+    rle=True时使用RLE Lossless传输语法（无损压缩，掩膜和大片0值的CT压缩率很高），
+    encode_workers为RLE编码进程数（None时为CPU核数，在run_batch子进程中为1）。
+    存储为int16还是uint16由数据的取值范围决定（pixel_format_for），两者都放不下时报错
+    """
+    ensure_dir(output_folder)
+    num_slices = volume.data.shape[2]
+    bits_allocated, pixel_representation = pixel_format_for(volume.data)
+    common_tags = dict(
+        modality="OT",
+        bits_allocated=bits_allocated,
+        pixel_representation=pixel_representation,
+        rescale=volume.scaling,
+        transfer_syntax=RLELossless if rle else ExplicitVRLittleEndian,
+        encode_workers=encode_workers,
+        PatientName="Anonymous",
+        PatientID="000001",
+        ImageType=["ORIGINAL", "PRIMARY"]
+    )
+    if multiframe:
+        pixel_spacing, thickness, orientation, positions = dicom_frame_geometry(volume.affine, num_slices)
+        writer = DicomSeriesWriter(pixel_spacing=pixel_spacing, slice_thickness=thickness, **common_tags)
+        # (x, y, z) → (帧, 行, 列)
+        frames = np.moveaxis(volume.data, 2, 0)
+        writer.write_multiframe(os.path.join(output_folder, f"{prefix}.dcm"), frames, positions, orientation)
+        return num_slices
+
+    writer = DicomSeriesWriter(**common_tags)
+    items = (
+        (os.path.join(output_folder, f"{prefix}{i + 1:03d}.dcm"), volume.data[:, :, i])
+        for i in range(num_slices)
+    )
+    return writer.write_series(items, threads=threads)
+
+
+# ---------------- PNG切片 ----------------
+def read_png_stack(png_dir: str, slice_axis: int = 2, threads: int = DEFAULT_IO_THREADS) -> Volume:
+    # 按自然顺序列出PNG，先只读文件头校验尺寸，再多线程解码到预分配的数组（8位为uint8），
+    # 最后整体转置为沿slice_axis堆叠的视图
+    png_files = list_png_files(png_dir)
+    if len(png_files) == 0:
+        raise ValueError(f"PNG文件夹中未找到任何.png文件：{png_dir}")
+
+    stack = read_png_slices(png_files, threads)
+
+    return Volume(
+        data=stack_to_volume(stack, slice_axis),
+        source_type="png",
+        source_name=os.path.basename(png_dir.rstrip("/\\")),
+        meta={"slice_files": [os.path.basename(f) for f in png_files]}
+    )
+
+
+def iter_nii_slices(nii_path: str, slice_axis: int = 2):
+    """
+    通过nibabel的数组代理(dataobj)逐张读取切片，不生成整个float64体数据。
+    未压缩.nii只读取需要的字节；返回(切片总数, 生成器)
+    """
+    img = nib.load(nii_path)
+    proxy = img.dataobj
+    slice_num = proxy.shape[slice_axis]
+
+    def gen():
+        index = [slice(None)] * len(proxy.shape)
+        for i in range(slice_num):
+            index[slice_axis] = i
+            yield np.asarray(proxy[tuple(index)])
+
+    return slice_num, gen()
+
+
+def write_png_stack_from_nii(
+        nii_path: str,
+        out_dir: str,
+        slice_axis: int = 2,
+        prefix: str = "png_nii",
+        desc: Optional[str] = None,
+        threads: int = DEFAULT_ENCODE_THREADS,
+        on_slice: Optional[Callable[[int, np.ndarray], None]] = None
+) -> int:
+    # 流式导出：内存中只保留编码线程正在处理的少量切片，结果与write_png_stack(read_nii(...))相同；
+    # on_slice(层号, 切片)在读出每张切片时调用（主线程，按顺序），用于顺带统计（如SliceIndexBuilder.add）
+    os.makedirs(out_dir, exist_ok=True)
+    slice_num, slices = iter_nii_slices(nii_path, slice_axis)
+    if on_slice is not None:
+        slices = (on_slice(k, s) or s for k, s in enumerate(slices))
+    out_paths = [os.path.join(out_dir, f"{prefix}{i + 1:03d}.png") for i in range(slice_num)]
+    export_slices_png(zip(out_paths, slices), total=slice_num, threads=threads, desc=desc)
+    return slice_num
+
+
+def write_png_stack(
+        volume: Volume,
+        out_dir: str,
+        slice_axis: int = 2,
+        prefix: str = "png_nii",
+        desc: Optional[str] = None,
+        threads: int = DEFAULT_ENCODE_THREADS,
+        per_slice: bool = True
+) -> int:
+    # 逐切片（per_slice=False则整卷）min-max归一化到0-255后并行编码保存，文件名如png_nii001.png
+    os.makedirs(out_dir, exist_ok=True)
+    slice_num = volume.data.shape[slice_axis]
+    out_paths = [os.path.join(out_dir, f"{prefix}{i + 1:03d}.png") for i in range(slice_num)]
+    export_volume_png(volume.data, out_paths, slice_axis, per_slice=per_slice, threads=threads, desc=desc)
+    return slice_num
+
+
+# ---------------- NPZ ----------------
+def read_npz(npz_path: str) -> Volume:
+    with np.load(npz_path) as npz:
+        # dcm-npz/nii-npz存为image，png-npz存为data
+        key = "image" if "image" in npz.files else "data"
+        data = npz[key]
+        meta = {}
+        if "slice_names" in npz.files:
+            # png-npz文件夹模式：data为(切片数, 高, 宽)，按read_png_stack的方式转为(x, y, z)
+            data = stack_to_volume(data, 2)
+            meta["slice_names"] = [str(s) for s in npz["slice_names"]]
+        affine = npz["affine"] if "affine" in npz.files else np.eye(4)
+        spacing = tuple(float(s) for s in npz["spacing"]) if "spacing" in npz.files \
+            else spacing_from_affine(affine)
+        source_type = str(npz["source_type"]) if "source_type" in npz.files else "npz"
+        source_name = str(npz["source_name"]) if "source_name" in npz.files else os.path.basename(npz_path)
+        meta.update({k: float(npz[k]) for k in ("scl_slope", "scl_inter") if k in npz.files})
+
+    return Volume(
+        data=data,
+        affine=affine,
+        spacing=spacing,
+        source_type=source_type,
+        source_name=source_name,
+        meta=meta
+    )
+
+
+def write_npz(volume: Volume, output_path: str) -> str:
+    if not output_path.endswith(".npz"):
+        output_path += ".npz"
+    ensure_dir(os.path.dirname(output_path) or ".")
+    slope, inter = volume.scaling
+    np.savez_compressed(
+        output_path,
+        image=volume.data,
+        affine=volume.affine,
+        spacing=np.array(volume.spacing),
+        source_type=volume.source_type,
+        source_name=volume.source_name,
+        scl_slope=slope,
+        scl_inter=inter
+    )
+    return output_path
+
+
+# ---------------- NPY文件夹（可内存映射） ----------------
+def read_npy(store_dir: str) -> Volume:
+    # data为只读内存映射，不会把整个体数据读进内存
+    store = NpyStore(store_dir)
+    return Volume(
+        data=store["image"],
+        affine=store.affine,
+        spacing=store.spacing or spacing_from_affine(store.affine),
+        source_type=store.meta.get("source_type", ""),
+        source_name=store.meta.get("source_name", ""),
+        meta={k: store.meta[k] for k in ("scl_slope", "scl_inter") if k in store.meta}
+    )
+
+
+def write_npy(volume: Volume, out_dir: str, extra: Optional[dict] = None) -> str:
+    # extra可附带其他成员，如{"label": mask}
+    arrays = {"image": volume.data}
+    arrays.update(extra or {})
+    return write_npy_store(
+        out_dir,
+        arrays,
+        affine=volume.affine,
+        spacing=volume.spacing,
+        source_type=volume.source_type,
+        source_name=volume.source_name,
+        scaling=volume.scaling
+    )
+
+
+# ---------------- 分块压缩文件（.vchk） ----------------
+def read_chunked(chunk_path: str, threads: int = DEFAULT_IO_THREADS) -> Volume:
+    # 整卷读取时各slab并行解压；只需部分切片时直接用ChunkedVolume.read_slices
+    store = ChunkedVolume(chunk_path)
+    return Volume(
+        data=store.read("image", threads),
+        affine=store.affine,
+        spacing=store.spacing or spacing_from_affine(store.affine),
+        source_type=store.header.get("source_type", ""),
+        source_name=store.header.get("source_name", ""),
+        meta={k: store.header[k] for k in ("scl_slope", "scl_inter") if k in store.header}
+    )
+
+
+def write_chunked_volume(
+        volume: Volume,
+        output_path: str,
+        extra: Optional[dict] = None,
+        chunk_slices: int = 8,
+        codec: str = "zlib",
+        level: int = 6
+) -> str:
+    # extra可附带其他成员，如{"label": mask}；codec可选zlib/lzma/bz2/none
+    arrays = {"image": volume.data}
+    arrays.update(extra or {})
+    return write_chunked(
+        output_path,
+        arrays,
+        chunk_slices=chunk_slices,
+        codec=codec,
+        level=level,
+        affine=volume.affine,
+        spacing=volume.spacing,
+        source_type=volume.source_type,
+        source_name=volume.source_name,
+        scaling=volume.scaling
+    )
+
+
+# ---------------- 按路径自动选择 ----------------
+def read_volume(path: str, **kwargs) -> Volume:
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, META_NAME)):
+            return read_npy(path)
+        if list_dicom_files(path):
+            return read_dicom_series(path)
+        return read_png_stack(path, **kwargs)
+    lower = path.lower()
+    if lower.endswith((".nii", ".nii.gz")):
+        return read_nii(path)
+    if lower.endswith(".npz"):
+        return read_npz(path)
+    if lower.endswith(CHUNK_EXT):
+        return read_chunked(path)
+    raise ValueError(f"不支持的输入格式：{path}")
+
+
+def write_volume(volume: Volume, path: str, **kwargs):
+    # 以_dcm/_png结尾的路径视为切片文件夹，_npy为内存映射文件夹
+    lower = path.lower().rstrip("/\\")
+    if lower.endswith((".nii", ".nii.gz")):
+        return write_nii(volume, path)
+    if lower.endswith(".npz"):
+        return write_npz(volume, path)
+    if lower.endswith("_npy"):
+        return write_npy(volume, path)
+    if lower.endswith(CHUNK_EXT):
+        return write_chunked_volume(volume, path, **kwargs)
+    if lower.endswith("_dcm"):
+        return write_dicom_series(volume, path, **kwargs)
+    if lower.endswith("_png"):
+        return write_png_stack(volume, path, **kwargs)
+    raise ValueError(f"不支持的输出格式：{path}")
+
+
+# ---------------- 与SimpleITK互转及重采样 ----------------
+# NIfTI的affine为RAS坐标，SimpleITK为LPS坐标，x、y轴需取反
+_RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0])
+
+
+def volume_to_sitk(volume: Volume) -> sitk.Image:
+    img = sitk.GetImageFromArray(np.transpose(volume.data, (2, 1, 0)))  # sitk数组格式：(z,y,x)
+    spacing = np.array(spacing_from_affine(volume.affine))
+    direction = _RAS_TO_LPS @ volume.affine[:3, :3] / spacing
+    img.SetSpacing(tuple(float(s) for s in spacing))
+    img.SetDirection(tuple(float(d) for d in direction.flatten()))
+    img.SetOrigin(tuple(float(o) for o in _RAS_TO_LPS @ volume.affine[:3, 3]))
+    return img
+
+
+def volume_from_sitk(img: sitk.Image, source_type: str = "", source_name: str = "") -> Volume:
+    spacing = np.array(img.GetSpacing())
+    direction = np.array(img.GetDirection()).reshape(3, 3)
+    affine = np.eye(4)
+    affine[:3, :3] = _RAS_TO_LPS @ direction * spacing
+    affine[:3, 3] = _RAS_TO_LPS @ np.array(img.GetOrigin())
+    return Volume(
+        data=np.transpose(sitk.GetArrayFromImage(img), (2, 1, 0)),
+        affine=affine,
+        spacing=tuple(float(s) for s in spacing),
+        source_type=source_type,
+        source_name=source_name
+    )
+
+
+def resample_image_z(img: sitk.Image, new_spacing_z_mm: float) -> sitk.Image:
+    # 仅调整z方向间距，x、y保持不变，线性插值
+    orig_spacing = img.GetSpacing()
+    orig_size = img.GetSize()
+
+    new_spacing = (orig_spacing[0], orig_spacing[1], new_spacing_z_mm)
+    new_size = [
+        orig_size[0],
+        orig_size[1],
+        int(np.ceil(orig_size[2] * (orig_spacing[2] / new_spacing_z_mm)))
+    ]
+
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetOutputSpacing(new_spacing)
+    resampler.SetSize(new_size)
+    resampler.SetOutputDirection(img.GetDirection())
+    resampler.SetOutputOrigin(img.GetOrigin())
+    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetDefaultPixelValue(0)
+
+    return resampler.Execute(img)
+
+
+def resample_volume_z(volume: Volume, new_spacing_z_mm: float) -> Volume:
+    resampled = resample_image_z(volume_to_sitk(volume), new_spacing_z_mm)
+    result = volume_from_sitk(resampled, volume.source_type, volume.source_name)
+    result.meta = dict(volume.meta)
+    return result
@@ -4,8 +4,12 @@ import cv2
 import numpy as np
 import nibabel as nib
 import os
+import sys
 from glob import glob
 from typing import Optional, Tuple
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import run_batch, parse_workers
+from common.lazy_volume import LazyVolume, axis_index
 def crop_medical_image(
         img: np.ndarray,
         crop_ratio: float = 0.8,
@@ -93,17 +97,12 @@ def augment_single_image(
 
     if is_nii:
 
-        nii_img = nib.load(img_path)
-        nii_data = nii_img.get_fdata()
-        slice_idx = nii_data.shape[slice_axis] // 2
-
-        if slice_axis == 0:
-            img = nii_data[slice_idx, :, :]
-        elif slice_axis == 1:
-            img = nii_data[:, slice_idx, :]
-        else:
-            img = nii_data[:, :, slice_idx]
+        # 只取中间一张切片：未压缩.nii通过内存映射只读这一张，.nii.gz解压一次
+        volume = LazyVolume(img_path)
+        slice_idx, img = volume.middle_slice(slice_axis)
         original_slice_size = img.shape  # 记录原始切片尺寸（height, width）
+        slope, inter = volume.scaling
+        img = img.astype(np.float64) * slope + inter
         img = (img - np.min(img)) / (np.max(img) - np.min(img)) * 255
         img = img.astype(np.uint8)
     else:
@@ -124,15 +123,11 @@ def augment_single_image(
         if augmented_img.shape != original_slice_size:
             augmented_img = cv2.resize(augmented_img, (original_slice_size[1], original_slice_size[0]),
                                        interpolation=cv2.INTER_LINEAR)
-        nii_data_aug = np.zeros_like(nii_data)
-        if slice_axis == 0:
-            nii_data_aug[slice_idx, :, :] = augmented_img
-        elif slice_axis == 1:
-            nii_data_aug[:, slice_idx, :] = augmented_img
-        else:
-            nii_data_aug[:, :, slice_idx] = augmented_img
+        # 增强结果本身是0-255的uint8，输出体数据也用uint8
+        nii_data_aug = np.zeros(volume.shape, dtype=np.uint8)
+        nii_data_aug[axis_index(slice_idx, slice_axis)] = augmented_img
 
-        nii_aug_img = nib.Nifti1Image(nii_data_aug, nii_img.affine)
+        nii_aug_img = nib.Nifti1Image(nii_data_aug, volume.affine)
         nib.save(nii_aug_img, output_path)
     else:
 
@@ -141,6 +136,13 @@ def augment_single_image(
     print(f" 增强完成：{img_path} → {output_path},尺寸：{augmented_img.shape}")
 
 
+def augment_single_image_seeded(seed: Optional[int], *args) -> None:
+    # 每个病例单独播种：seed固定时串行与多进程结果逐字节一致；
+    # seed为None时从系统熵重新播种，避免fork出的子进程共享同一随机序列
+    np.random.seed(seed)
+    augment_single_image(*args)
+
+
 def batch_augment_images(
         input_dir: str,
         output_dir: str,
@@ -150,7 +152,9 @@ def batch_augment_images(
         angle_range: Tuple[float, float] = (-30, 30),
         keep_size: bool = True,
         is_nii: bool = False,
-        slice_axis: int = 2
+        slice_axis: int = 2,
+        workers: int = 1,
+        seed: Optional[int] = None
 ) -> None:
 
 
@@ -166,6 +170,7 @@ def batch_augment_images(
         raise ValueError(f"{input_dir}中未找到{'NII' if is_nii else 'PNG'}文件")
 
 
+    jobs = []
     for idx, file_path in enumerate(file_paths):
 
         filename = os.path.basename(file_path)
@@ -177,14 +182,17 @@ def batch_augment_images(
             output_filename = f"{name}_aug{ext}"
         output_path = os.path.join(output_dir, output_filename)
 
-        # 执行增强
-        try:
-            augment_single_image(
-                file_path, output_path, crop_ratio, is_random_crop,
-                rotate_angle, angle_range, keep_size, is_nii, slice_axis
-            )
-        except Exception as e:
-            print(f" 处理失败 {file_path}：{str(e)}")
+        case_seed = None if seed is None else seed + idx
+        jobs.append((
+            case_seed, file_path, output_path, crop_ratio, is_random_crop,
+            rotate_angle, angle_range, keep_size, is_nii, slice_axis
+        ))
+
+    # 执行增强（workers>1时多进程并行，大文件优先）
+    results = run_batch(augment_single_image_seeded, jobs, workers=workers, size_paths=file_paths)
+    for r in results:
+        if not r.ok:
+            print(f" 处理失败 {file_paths[r.index]}：{r.error}")
 
     print(f"\n 批量增强完成！共处理 {len(file_paths)} 个文件，输出至：{output_dir}")
 
@@ -197,6 +205,8 @@ if __name__ == "__main__":
     CROP_RATIO = 0.9  # 默认裁剪比例为0.8
     IS_RANDOM_CROP = True  # TRUE随机裁剪,False中心裁剪
     ROTATE_ANGLE = 10  # 固定旋转角度,默认±30度
+    WORKERS = parse_workers()  # 并行进程数，命令行 --workers N
+    SEED = None  # 随机种子，固定后多次运行（无论是否并行）结果一致
 
     # 下面为批量增强
     try:
@@ -206,7 +216,9 @@ if __name__ == "__main__":
             crop_ratio=CROP_RATIO,
             is_random_crop=IS_RANDOM_CROP,
             rotate_angle=ROTATE_ANGLE,
-            is_nii=IS_NII
+            is_nii=IS_NII,
+            workers=WORKERS,
+            seed=SEED
         )
     except Exception as e:
         print(f"批量处理失败：{str(e)}")
\ No newline at end of file
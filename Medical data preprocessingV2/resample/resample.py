@@ -1,7 +1,11 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import sys
 import SimpleITK as sitk
 import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.volume import resample_image_z
 
 def resample_volume(input_path, output_path, new_spacing_z_mm):
 
@@ -28,17 +32,8 @@ def resample_volume(input_path, output_path, new_spacing_z_mm):
     print("新间距:", new_spacing)
     print("新尺寸:", new_size)
 
-    # 开始重采样
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetOutputSpacing(new_spacing)
-    resampler.SetSize(new_size)
-    resampler.SetOutputDirection(img.GetDirection())
-    resampler.SetOutputOrigin(img.GetOrigin())
-    resampler.SetInterpolator(sitk.sitkLinear)
-    resampler.SetDefaultPixelValue(0)
-
-
-    resampled = resampler.Execute(img)
+    # 开始重采样（内存中的Volume可直接用common.volume.resample_volume_z，无需落盘）
+    resampled = resample_image_z(img, new_spacing_z_mm)
 
     # 输出重采样的文件以及对应的地址
     sitk.WriteImage(resampled, output_path)
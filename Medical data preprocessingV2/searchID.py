@@ -1,6 +1,13 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+# Bulk mode: default cache file (kept in root_dir) and thread count for listing patient folders
+ID_CACHE_NAME = ".searchid_cache.json"
+DEFAULT_SCAN_THREADS = 32
 
 def extract_ids_with_blank_lines(
     root_dir: str,
@@ -51,9 +58,109 @@ def extract_ids_with_blank_lines(
             f.write(f"{line}\n")
 
 
+def _first_subfolder(folder_path: str) -> str:
+    # Same rule as extract_ids_with_blank_lines: first sub-subfolder name in sorted order, or ""
+    try:
+        with os.scandir(folder_path) as it:
+            subfolders = sorted(e.name for e in it if e.is_dir())
+    except OSError:
+        return ""
+    return subfolders[0] if subfolders else ""
+
+
+def build_id_map(
+    root_dir: str,
+    threads: int = DEFAULT_SCAN_THREADS,
+    cache_path: Optional[str] = None,
+    use_cache: bool = True
+) -> Dict[str, str]:
+    """
+    Scan root_dir once and return {subfolder name: ID}, where ID is the name of the
+    first sub-subfolder ("" if there is none).
+    - root_dir is listed once with os.scandir; the subfolders are listed on a thread pool,
+      so round trips to a network share overlap instead of running one after another
+    - results are cached on disk together with each subfolder's mtime; adding or removing
+      an ID folder changes that mtime, so only changed subfolders are listed again
+    """
+    if cache_path is None:
+        cache_path = os.path.join(root_dir, ID_CACHE_NAME)
+
+    cache = {}
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+    with os.scandir(root_dir) as it:
+        entries = [e for e in it if e.is_dir() and not e.name.startswith('.')]
+
+    def resolve(entry) -> tuple:
+        mtime_ns = entry.stat().st_mtime_ns
+        cached = cache.get(entry.name)
+        if cached is not None and cached[0] == mtime_ns:
+            return entry.name, cached
+        return entry.name, [mtime_ns, _first_subfolder(entry.path)]
+
+    if threads and threads > 1 and len(entries) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(entries))) as executor:
+            resolved = dict(executor.map(resolve, entries))
+    else:
+        resolved = dict(resolve(e) for e in entries)
+
+    if use_cache and resolved != cache:
+        try:
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(resolved, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write cache {cache_path}: {e}")
+
+    return {name: value[1] for name, value in resolved.items()}
+
+
+def extract_ids_bulk(
+    root_dir: str,
+    input_txt: str,
+    output_txt: str,
+    threads: int = DEFAULT_SCAN_THREADS,
+    cache_path: Optional[str] = None,
+    use_cache: bool = True
+):
+    """
+    Same output as extract_ids_with_blank_lines (order and blank lines preserved),
+    but every line is answered from one build_id_map scan instead of listing
+    folders line by line
+    """
+    with open(input_txt, 'r', encoding='utf-8-sig') as f:
+        subfolder_names = [line.strip() for line in f]
+
+    id_map = build_id_map(root_dir, threads, cache_path, use_cache)
+    # Match names the way the file system does (case-insensitive on Windows)
+    lookup = {os.path.normcase(name): folder_id for name, folder_id in id_map.items()}
+
+    results = []
+    for name in subfolder_names:
+        if not name:
+            results.append("")
+        elif os.sep in name or (os.altsep and os.altsep in name):
+            # Nested paths are not in the map: fall back to a direct lookup
+            folder_path = os.path.join(root_dir, name)
+            results.append(_first_subfolder(folder_path) if os.path.isdir(folder_path) else "")
+        else:
+            results.append(lookup.get(os.path.normcase(name), ""))
+
+    with open(output_txt, 'w', encoding='utf-8') as f:
+        for line in results:
+            f.write(f"{line}\n")
+
+
 # Example usage
 if __name__ == "__main__":
-    extract_ids_with_blank_lines(
+    # Bulk mode (one scan + cache); extract_ids_with_blank_lines(...) gives the same result line by line
+    extract_ids_bulk(
         root_dir="F:/guiling-CRC-MSI-CTdata/1-800-sorted-data",
         input_txt="F:/guiling-CRC-MSI-CTdata/1-800-sorted-data/filename.txt",
         output_txt="F:/guiling-CRC-MSI-CTdata/1-800-sorted-data/result.txt"
@@ -1,65 +1,62 @@
 #!/user/bin/env python3
 # -*- coding: utf-8 -*-
+import json
 import os
+import sys
 import numpy as np
 import SimpleITK as sitk
 from skimage import measure
 import matplotlib.pyplot as plt
 import trimesh
-import pydicom
-import cv2
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.batch import DEFAULT_IO_THREADS
+from common.dicom_catalog import DicomCatalog, open_catalog
+from common.dicom_series import read_series_pixels, rescale_pixels, series_geometry, stored_dtype
+from common.rtstruct import extract_roi_labelmap, image_geometry, rasterize_contours, read_rtstruct
 # 1. 读取DICOM序列
-def load_dicom_series(dicom_dir):
+def load_dicom_series(dicom_dir, threads=DEFAULT_IO_THREADS, catalog=None):
     """
     读取DICOM影像序列
+    序列和文件顺序从DICOM索引（common.dicom_catalog，默认为用户缓存目录中的共用索引）中查询，
+    只有新增或修改过的文件才重新读头信息；顺序与GDCM一致（按层位置）。像素在线程池中并发读取（threads=1为串行）
     """
-    reader = sitk.ImageSeriesReader()
-    series_ids = reader.GetGDCMSeriesIDs(dicom_dir)
+    catalog = open_catalog(dicom_dir, catalog, threads)
+    headers = catalog.series_headers(catalog.main_series(dicom_dir), dicom_dir)
+    series_files = [h.path for h in headers]
 
-    if not series_ids:
-        raise RuntimeError("目录中未发现DICOM影像序列")
+    pixels = read_series_pixels(headers, dtype=stored_dtype(headers[0]), threads=threads)
+    volume = np.transpose(pixels, (2, 0, 1))  # (Z, Y, X)
+    # 与GDCM一致：整数斜率/截距且范围放得下时保持int16（CT常见的-1024截距），否则才转为浮点
+    volume = rescale_pixels(volume, headers[0].rescale_slope, headers[0].rescale_intercept)
 
-    series_files = reader.GetGDCMSeriesFileNames(dicom_dir, series_ids[0])
-    reader.SetFileNames(series_files)
+    origin, sitk_spacing, direction = series_geometry(headers)
+    image = sitk.GetImageFromArray(volume)
+    image.SetOrigin(origin)
+    image.SetSpacing(sitk_spacing)
+    image.SetDirection(tuple(float(d) for d in direction.flatten()))
 
-    image = reader.Execute()
-
-    volume = sitk.GetArrayFromImage(image)  # (Z, Y, X)
     spacing = image.GetSpacing()
     spacing = (spacing[2], spacing[1], spacing[0])
 
     return volume, spacing, image, series_files
 
-def find_rtstruct(dicom_dir):
-    for f in os.listdir(dicom_dir):
-        if f.upper().startswith("RTSTRUCT") and f.lower().endswith(".dcm"):
-            return os.path.join(dicom_dir, f)
-    raise FileNotFoundError("未找到RTSTRUCT文件")
-def world_to_voxel(coord, origin, spacing, direction):
-    """
-    将物理坐标(mm)转换为体素索引
-    """
-    coord = np.array(coord)
-    origin = np.array(origin)
-    spacing = np.array(spacing)
-
-    relative = coord - origin
-    voxel = np.linalg.inv(np.array(direction).reshape(3, 3)).dot(relative)
-    voxel = voxel / spacing
-
-    return np.round(voxel).astype(int)
+def find_rtstruct(dicom_dir, catalog=None):
+    # 按Modality=RTSTRUCT从DICOM索引中查找，不依赖文件名前缀
+    rtstructs = open_catalog(dicom_dir, catalog).find_rtstruct(dicom_dir)
+    if not rtstructs:
+        raise FileNotFoundError("未找到RTSTRUCT文件")
+    return rtstructs[0]
 # 2. 读取GTV标签（DICOM或NII）
-def extract_gtv_mask(rtstruct_path, sitk_img, volume_shape):
+def extract_gtv_mask(rtstruct_path, sitk_img, volume_shape, mode="or"):
     """
     从RTSTRUCT中解析GTV并生成三维mask
+    mode="or"（默认）为所有轮廓取并集；mode="xor"时同一层内嵌套的轮廓视为空洞
     """
-    ds = pydicom.dcmread(rtstruct_path)
+    # 只解析需要的元素，轮廓数据按ROI直接从原始字节批量解码（同一文件的解析结果会被缓存）
+    rtstruct = read_rtstruct(rtstruct_path)
 
     # ROI名称映射
-    roi_number_to_name = {
-        roi.ROINumber: roi.ROIName
-        for roi in ds.StructureSetROISequence
-    }
+    roi_number_to_name = rtstruct.roi_names
 
     # 找GTV
     gtv_roi_number = None
@@ -72,41 +69,10 @@ def extract_gtv_mask(rtstruct_path, sitk_img, volume_shape):
     if gtv_roi_number is None:
         raise ValueError("RTSTRUCT中未找到GTV")
 
-    origin = sitk_img.GetOrigin()
-    spacing = sitk_img.GetSpacing()
-    direction = sitk_img.GetDirection()
-
-    mask = np.zeros(volume_shape, dtype=np.uint8)
-
-    for roi_contour in ds.ROIContourSequence:
-        if roi_contour.ReferencedROINumber != gtv_roi_number:
-            continue
-
-        for contour in roi_contour.ContourSequence:
-            coords = np.array(contour.ContourData).reshape(-1, 3)
-
-            # 取Z层
-            z_world = coords[0, 2]
-            z_index = world_to_voxel(
-                [0, 0, z_world],
-                origin,
-                spacing,
-                direction
-            )[2]
-
-            polygon = []
-            for pt in coords:
-                voxel = world_to_voxel(pt, origin, spacing, direction)
-                polygon.append([voxel[0], voxel[1]])
-
-            polygon = np.array(polygon, dtype=np.int32)
-
-            if 0 <= z_index < volume_shape[0]:
-                slice_mask = np.zeros(volume_shape[1:], dtype=np.uint8)
-                cv2.fillPoly(slice_mask, [polygon], 1)
-                mask[z_index] |= slice_mask
-
-    return mask
+    # 方向矩阵只求一次逆，每条轮廓整体转换到体素坐标后直接填入对应层
+    contours = rtstruct.contours(gtv_roi_number)
+    origin, spacing, direction = image_geometry(sitk_img)
+    return rasterize_contours(contours, origin, spacing, direction, volume_shape, mode=mode)
 # 3. 提取肿瘤区域并重建3D表面
 def reconstruct_3d_surface(mask, spacing):
     verts, faces, _, _ = measure.marching_cubes(
@@ -135,13 +101,24 @@ def visualize_3d(verts, faces):
 def export_stl(verts, faces, path):
     mesh = trimesh.Trimesh(vertices=verts, faces=faces)
     mesh.export(path)
+
+# 5. 多ROI标签图导出为NII（几何信息与CT一致），标签对照表写在同名.json中
+def export_labelmap(labelmap, table, sitk_img, path):
+    label_img = sitk.GetImageFromArray(labelmap)
+    label_img.CopyInformation(sitk_img)
+    sitk.WriteImage(label_img, path)
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, indent=2)
 # 6. 根据实际路径修改！
 if __name__ == "__main__":
     dicom_dir = r"G:\mry1\TOM500\tumor dataset\guoshusen1153\Structure\20191153_guoshusen1153" #原始DICOM数据目录
     output_stl = r"G:\mry1\TOM500\tumor dataset\guoshusen1153\output"   #输出STL文件路径
+    roi_pattern = None  # 如r"^(gtv|ctv)"：同时把匹配的全部ROI导出为一个标签图；None不导出
+    output_labelmap = r"G:\mry1\TOM500\tumor dataset\guoshusen1153\labelmap.nii.gz"
 
-    volume, spacing, sitk_img, _ = load_dicom_series(dicom_dir)
-    rtstruct_path = find_rtstruct(dicom_dir)
+    catalog = DicomCatalog.default()  # 所有病例共用一个索引（不写入数据目录）；也可DicomCatalog("索引文件路径")
+    volume, spacing, sitk_img, _ = load_dicom_series(dicom_dir, catalog=catalog)
+    rtstruct_path = find_rtstruct(dicom_dir, catalog=catalog)
 
     gtv_mask = extract_gtv_mask(
         rtstruct_path,
@@ -149,6 +126,11 @@ if __name__ == "__main__":
         volume.shape
     )
 
+    if roi_pattern is not None:
+        labelmap, table = extract_roi_labelmap(rtstruct_path, sitk_img, volume.shape, pattern=roi_pattern)
+        export_labelmap(labelmap, table, sitk_img, output_labelmap)
+        print("已导出标签图:", table)
+
     verts, faces = reconstruct_3d_surface(gtv_mask, spacing)
     visualize_3d(verts, faces)
     export_stl(verts, faces, output_stl)